@@ -1,12 +1,18 @@
 """Ingestion module for GitHub data via Google BigQuery."""
 
-import base64
+import multiprocessing
+import os
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from itertools import batched
 from typing import Optional
 
-from google.cloud import bigquery
+import pybase64
+from google.cloud import bigquery, bigquery_storage
 from loguru import logger
 
-from processing.filters import passes_filters
+from processing.filters import BATCH_SIZE, MAX_CHARS, MIN_LINES, passes_filters_batch
 from processing.licenses import classify_license_type
 
 # Valid extensions for each language (case-insensitive)
@@ -25,8 +31,25 @@ VALID_EXTENSIONS = {
     },
 }
 
-# Lazy-load BigQuery client to avoid import-time credential checks
+# Flattened lookups for the query filter and language inference
+_ALL_VALID_EXTENSIONS = frozenset(
+    ext for extensions in VALID_EXTENSIONS.values() for ext in extensions
+)
+_EXT_TO_LANG = {
+    ext: language
+    for language, extensions in VALID_EXTENSIONS.items()
+    for ext in extensions
+}
+
+# Rows per page if the result falls back to the REST API
+QUERY_PAGE_SIZE = 10_000
+
+# Columns selected by the query, in the order _process_batch unpacks them
+_COLUMNS = ("repo_name", "path", "content", "license")
+
+# Lazy-load BigQuery clients to avoid import-time credential checks
 _client: Optional[bigquery.Client] = None
+_bqstorage_client: Optional[bigquery_storage.BigQueryReadClient] = None
 
 
 def _get_client() -> bigquery.Client:
@@ -37,40 +60,144 @@ def _get_client() -> bigquery.Client:
     return _client
 
 
-def _extract_extension(file_path: str) -> str:
-    """Extract file extension from path."""
-    if not file_path:
-        return ""
-    # Get the last part after the last dot
-    parts = file_path.rsplit(".", 1)
-    if len(parts) > 1:
-        return parts[-1].lower()
-    return ""
+def _get_bqstorage_client() -> bigquery_storage.BigQueryReadClient:
+    """Get or initialize the BigQuery Storage Read API client (lazy loading)."""
+    global _bqstorage_client
+    if _bqstorage_client is None:
+        _bqstorage_client = bigquery_storage.BigQueryReadClient()
+    return _bqstorage_client
+
+
+def _decoded_length(content_b64: str) -> int:
+    """Number of bytes a padded base64 string decodes to, without decoding it."""
+    return len(content_b64) // 4 * 3 - content_b64[-2:].count("=")
 
 
-def _infer_language_from_extension(extension: str) -> str:
-    """Infer language from file extension."""
-    extension = extension.lower().lstrip(".")
+def _decode_content(content_bytes: bytes) -> str:
+    """Decode file bytes, taking CPython's faster ASCII codec when the file is pure ASCII."""
+    try:
+        return content_bytes.decode("ascii")
+    except UnicodeDecodeError:
+        # latin-1 maps every byte, so binary-like content and non-ASCII source
+        # characters (e.g. the PL/I NOT sign) survive decoding unchanged
+        return content_bytes.decode("latin-1")
+
+
+def _init_worker() -> None:
+    """Initialize a worker process for _process_batch."""
+    # Parallelism comes from the process pool, so keep each worker's Rust
+    # tokenizer single-threaded rather than oversubscribing the cores
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+
+def _process_batch(batch: tuple[tuple[str, str, Optional[str], Optional[str]], ...]) -> tuple[list[dict], int]:
+    """
+    Decode, filter and normalize a batch of raw BigQuery rows.
     
-    # Check each language's valid extensions
-    for language, extensions in VALID_EXTENSIONS.items():
-        if extension in extensions:
-            return language
+    Args:
+        batch: (repo_name, path, base64 content, license) tuples
+        
+    Returns:
+        Tuple of (normalized rows, rows skipped)
+    """
+    skipped = 0
+    rows = []
     
-    # Default fallback
-    if extension == "jcl":
-        return "JCL"
-    elif extension in ("pli", "pl1"):
-        return "PL/I"
-    elif extension == "asm":
-        return "HLASM"
-    elif extension == "bms":
-        return "BMS"
+    for repo_name, path, content_b64, license_name in batch:
+        # Extract extension (rpartition avoids the list rsplit would allocate)
+        # and infer language with a single dict lookup
+        _, dot, extension = path.rpartition(".")
+        extension = extension.lower() if dot else ""
+        language = _EXT_TO_LANG.get(extension, "UNKNOWN")
+        
+        # BigQuery leaves content NULL for files it doesn't store inline (over ~1 MB)
+        if not content_b64:
+            skipped += 1
+            continue
+        
+        # Content is decoded one byte per character (see _decode_content), so
+        # files the length filters would reject are skipped without decoding
+        if not MIN_LINES <= _decoded_length(content_b64) <= MAX_CHARS:
+            skipped += 1
+            continue
+        
+        # Decode base64 content (pybase64 dispatches to SIMD kernels at runtime)
+        try:
+            content_bytes = pybase64.b64decode(content_b64, validate=False)
+        except Exception as e:
+            logger.warning(f"Failed to decode content for {repo_name}/{path}: {e}")
+            skipped += 1
+            continue
+        
+        # Classify license type (permissive or no_license)
+        license_name = license_name or None
+        license_type = classify_license_type(license_name)
+        licenses_array = [license_name] if license_name else []
+        
+        # Normalize to unified schema
+        rows.append({
+            "content": content_bytes,  # Decoded to text once the row passes the filters
+            "repo_name": repo_name,
+            "file_path": path,
+            "language": language,
+            "extension": extension,
+            "license_type": license_type,  # "permissive" or "no_license"
+            "licenses": licenses_array,  # Array of actual license names
+            "host_url": "https://github.com",
+            "source": "bigquery",
+            "num_tokens": None,  # Filled in once the batch is tokenized
+            # BigQuery doesn't have commit/revision info, use empty values
+            "revision_id": "",  # Not available in BigQuery
+            "commit_date": "",  # Not available in BigQuery
+            "branch": "",  # Not available in BigQuery
+        })
     
-    return "UNKNOWN"
+    if not rows:
+        return [], skipped
+    
+    # Apply shared filtering logic to the whole batch at once, on the raw
+    # bytes so rejected files are never decoded to text
+    token_counts = passes_filters_batch([row["content"] for row in rows])
+    passed = []
+    for normalized_row, num_tokens in zip(rows, token_counts):
+        if num_tokens is None:
+            skipped += 1
+            continue
+        normalized_row["content"] = _decode_content(normalized_row["content"])
+        normalized_row["num_tokens"] = num_tokens
+        passed.append(normalized_row)
+    
+    return passed, skipped
 
 
-def load_bigquery():
+def _process_batches(raw_rows: Iterable[tuple], num_workers: int) -> Iterator[tuple[list[dict], int]]:
+    """
+    Run _process_batch over raw rows in BATCH_SIZE chunks, yielding results in order.
+    
+    With more than one worker, batches are fanned out to a process pool with
+    a bounded number in flight so the BigQuery iterator is never drained
+    ahead of the consumer.
+    """
+    batches = batched(raw_rows, BATCH_SIZE)
+    if num_workers <= 1:
+        yield from map(_process_batch, batches)
+        return
+    
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    ) as executor:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(executor.submit(_process_batch, batch))
+            if len(in_flight) >= 2 * num_workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def load_bigquery(num_workers: int = 1):
     """
     Query GitHub public repos via BigQuery and yield normalized rows.
     
@@ -80,16 +207,17 @@ def load_bigquery():
     - HLASM (.asm, .mac, .mlc, .cpy)
     - BMS (.bms, .map)
     
+    Args:
+        num_workers: Number of processes used to decode and filter rows
+            (1 processes rows in the calling process)
+    
     Yields:
         Dictionary with normalized row data matching the unified schema
     """
-    # Build extension filter for WHERE clause
-    all_extensions = []
-    for extensions in VALID_EXTENSIONS.values():
-        all_extensions.extend(extensions)
-    
-    # Remove duplicates and create LIKE clauses
-    extension_patterns = [f"f.path LIKE '%.{ext}'" for ext in set(all_extensions)]
+    # Build extension filter for WHERE clause (sorted so the query text is
+    # stable across runs and BigQuery can serve it from its results cache).
+    # This is the only extension filter; rows are not re-checked in Python
+    extension_patterns = [f"f.path LIKE '%.{ext}'" for ext in sorted(_ALL_VALID_EXTENSIONS)]
     extension_filter = " OR ".join(extension_patterns)
     
     query = f"""
@@ -115,71 +243,28 @@ def load_bigquery():
     logger.info("Executing BigQuery query...")
     client = _get_client()
     query_job = client.query(query)
-    results = query_job.result()
+    # Stream Arrow record batches over the Storage Read API rather than paging
+    # JSON rows through the REST row iterator; large pages keep round trips
+    # down if the client has to fall back to REST
+    record_batches = query_job.result(page_size=QUERY_PAGE_SIZE).to_arrow_iterable(
+        bqstorage_client=_get_bqstorage_client()
+    )
     
     count = 0
     skipped = 0
-    skipped_extensions = 0
     
-    for row in results:
-        # Extract extension and infer language
-        extension = _extract_extension(row.path)
-        language = _infer_language_from_extension(extension)
-        
-        # Filter by valid extensions
-        all_valid_extensions = set()
-        for ext_set in VALID_EXTENSIONS.values():
-            all_valid_extensions.update(ext_set)
-        
-        if extension not in all_valid_extensions:
-            skipped_extensions += 1
-            continue
-        
-        # Decode base64 content
-        try:
-            content_bytes = base64.b64decode(row.content)
-            # Use latin-1 encoding with errors="ignore" to handle binary-like content
-            content = content_bytes.decode("latin-1", errors="ignore")
-        except Exception as e:
-            logger.warning(f"Failed to decode content for {row.repo_name}/{row.path}: {e}")
-            skipped += 1
-            continue
-        
-        # Apply shared filtering logic
-        num_tokens = passes_filters(content)
-        if num_tokens is None:
-            skipped += 1
-            continue
-        
-        # Classify license type (permissive or no_license)
-        license_name = row.license or None
-        license_type = classify_license_type(license_name)
-        licenses_array = [license_name] if license_name else []
-        
-        # Normalize to unified schema
-        normalized_row = {
-            "content": content,
-            "repo_name": row.repo_name,
-            "file_path": row.path,
-            "language": language,
-            "extension": extension,
-            "license_type": license_type,  # "permissive" or "no_license"
-            "licenses": licenses_array,  # Array of actual license names
-            "host_url": "https://github.com",
-            "source": "bigquery",
-            "num_tokens": num_tokens,
-            # BigQuery doesn't have commit/revision info, use empty values
-            "revision_id": "",  # Not available in BigQuery
-            "commit_date": "",  # Not available in BigQuery
-            "branch": "",  # Not available in BigQuery
-        }
-        
-        yield normalized_row
-        count += 1
-    
-    skip_msg = f"Loaded {count} files from BigQuery (skipped {skipped} failed filters"
-    if skipped_extensions > 0:
-        skip_msg += f", {skipped_extensions} invalid extensions"
-    skip_msg += ")"
-    logger.info(skip_msg)
+    # Convert each record batch column-wise into plain tuples, which are also
+    # cheap to pickle when batches go to worker processes
+    raw_rows = (
+        row
+        for record_batch in record_batches
+        for row in zip(*(record_batch.column(name).to_pylist() for name in _COLUMNS))
+    )
+    
+    for rows, batch_skipped in _process_batches(raw_rows, num_workers):
+        skipped += batch_skipped
+        yield from rows
+        count += len(rows)
+    
+    logger.info(f"Loaded {count} files from BigQuery (skipped {skipped} failed filters)")
 
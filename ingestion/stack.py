@@ -1,15 +1,21 @@
 """Ingestion module for The Stack v2 dataset via Software Heritage."""
 
 import os
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import batched
 from typing import Optional
 
 import boto3
-from datasets import load_dataset
+from botocore.config import Config
+from datasets import IterableDataset, load_dataset
 from dotenv import load_dotenv
 from loguru import logger
 from smart_open import open as sopen
 
-from processing.filters import passes_filters
+from processing.filters import BATCH_SIZE, passes_filters_batch
 
 load_dotenv()
 
@@ -26,13 +32,17 @@ VALID_EXTENSIONS = {
     },
 }
 
+DOWNLOAD_WORKERS = 64  # concurrent Software Heritage downloads
+DOWNLOAD_PREFETCH = 256  # downloads kept in flight ahead of the consumer
+
 # Initialize AWS S3 client for Software Heritage
 session = boto3.Session(
     aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
     aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
     aws_session_token=os.getenv("AWS_SESSION_TOKEN"),
 )
-s3 = session.client("s3")
+# Size the connection pool so concurrent downloads don't queue on botocore's default of 10
+s3 = session.client("s3", config=Config(max_pool_connections=DOWNLOAD_WORKERS))
 
 
 def download_blob(id: str, encoding: str) -> Optional[str]:
@@ -51,6 +61,41 @@ def download_blob(id: str, encoding: str) -> Optional[str]:
     return content
 
 
+def _prefetch_blobs(rows: Iterable[dict]) -> Iterator[tuple[dict, Optional[str]]]:
+    """
+    Yield (row, content) pairs in input order, downloading blobs ahead in a thread pool.
+    
+    Downloads are latency-bound, so up to DOWNLOAD_PREFETCH requests are kept
+    in flight across DOWNLOAD_WORKERS threads while the caller filters and
+    tokenizes earlier rows.
+    """
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+        in_flight = deque()
+        for row in rows:
+            future = executor.submit(download_blob, row["blob_id"], row["src_encoding"])
+            in_flight.append((row, future))
+            if len(in_flight) >= DOWNLOAD_PREFETCH:
+                row, future = in_flight.popleft()
+                yield row, future.result()
+        while in_flight:
+            row, future = in_flight.popleft()
+            yield row, future.result()
+
+
+@lru_cache(maxsize=None)
+def _get_dataset(language: str) -> IterableDataset:
+    """Get the streaming Stack v2 dataset for a language (resolved once per process)."""
+    # Stream rows instead of downloading whole parquet shards up front; the
+    # streaming dataset can be iterated again, so the hub lookup is reused
+    return load_dataset(
+        "bigcode/the-stack-v2-dedup",
+        data_dir=f"data/{language}",
+        token=os.environ["HF_TOKEN"],
+        split="train",
+        streaming=True,
+    )
+
+
 def load_stack(language: str):
     """
     Load and yield normalized rows from The Stack v2 for a given language.
@@ -61,29 +106,7 @@ def load_stack(language: str):
     Yields:
         Dictionary with normalized row data matching the unified schema
     """
-    dataset = load_dataset(
-        "bigcode/the-stack-v2-dedup",
-        data_dir=f"data/{language}",
-        token=os.environ["HF_TOKEN"],
-        split="train",
-    )
-    
-    dataset = dataset.map(
-        lambda row: {
-            "content": download_blob(row["blob_id"], row["src_encoding"]),
-            "licenses": row["detected_licenses"],
-            "license_type": row["license_type"],
-            "host_url": "https://github.com",
-            "repo_name": row["repo_name"],
-            "file_path": row["path"],
-            "language": row["language"],
-            "extension": row["extension"],
-            "branch": row["branch_name"],
-            "revision_id": row["revision_id"],
-            "commit_date": row["committer_date"].isoformat(),
-        },
-        remove_columns=dataset.column_names
-    )
+    dataset = _get_dataset(language)
     
     # Get valid extensions for this language
     valid_extensions = VALID_EXTENSIONS.get(language.upper(), set())
@@ -91,41 +114,53 @@ def load_stack(language: str):
     count = 0
     skipped_extensions = 0
     
-    for row in dataset:
-        if row["content"] is None:
-            continue
-        
-        # Filter by extension if specified for this language
-        if valid_extensions:
-            extension = row["extension"].lower().lstrip(".") if row["extension"] else ""
-            if extension not in valid_extensions:
-                skipped_extensions += 1
+    def valid_rows():
+        """Yield rows with a valid extension, so invalid ones are never downloaded."""
+        nonlocal skipped_extensions
+        for row in dataset:
+            # Filter by extension if specified for this language
+            if valid_extensions:
+                extension = row["extension"].lower().lstrip(".") if row["extension"] else ""
+                if extension not in valid_extensions:
+                    skipped_extensions += 1
+                    continue
+            yield row
+    
+    for batch in batched(_prefetch_blobs(valid_rows()), BATCH_SIZE):
+        rows = []
+        for row, content in batch:
+            if content is None:
                 continue
             
-        # Apply shared filtering logic
-        num_tokens = passes_filters(row["content"])
-        if num_tokens is None:
-            continue
+            # Normalize to unified schema
+            rows.append({
+                "content": content,
+                "repo_name": row["repo_name"],
+                "file_path": row["path"],  # path within the repo
+                "language": row["language"],
+                "extension": row["extension"],
+                "license_type": row["license_type"],  # License type (string)
+                "licenses": row["detected_licenses"],  # Array of licenses
+                "host_url": "https://github.com",
+                "source": "stack",
+                "num_tokens": None,  # Filled in once the batch is tokenized
+                "revision_id": row["revision_id"],  # SWH revision (commit) id
+                "commit_date": row["committer_date"].isoformat(),
+                "branch": row["branch_name"],
+            })
         
-        # Normalize to unified schema
-        normalized_row = {
-            "content": row["content"],
-            "repo_name": row["repo_name"],
-            "file_path": row["file_path"],
-            "language": row["language"],
-            "extension": row.get("extension", ""),
-            "license_type": row["license_type"],  # License type (string)
-            "licenses": row.get("licenses", []),  # Array of licenses
-            "host_url": row["host_url"],
-            "source": "stack",
-            "num_tokens": num_tokens,
-            "revision_id": row["revision_id"],
-            "commit_date": row["commit_date"],
-            "branch": row.get("branch", ""),  # Include branch
-        }
+        if not rows:
+            continue
         
-        yield normalized_row
-        count += 1
+        # Apply shared filtering logic to the whole batch at once
+        token_counts = passes_filters_batch([row["content"] for row in rows])
+        for normalized_row, num_tokens in zip(rows, token_counts):
+            if num_tokens is None:
+                continue
+            normalized_row["num_tokens"] = num_tokens
+            
+            yield normalized_row
+            count += 1
     
     if skipped_extensions > 0:
         logger.info(f"Loaded {count} files for {language} (skipped {skipped_extensions} files with invalid extensions)")
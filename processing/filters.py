@@ -1,27 +1,129 @@
 """Shared filtering logic for content validation and token counting."""
 
+import threading
+from collections import OrderedDict
 from typing import Optional
 
+import numpy as np
+import xxhash
+from tokenizers import Tokenizer
 from transformers import AutoTokenizer
 
 # Filter constants
 MIN_LINES = 10  # minimum number of lines in a file
 MAX_LINES = 10000  # maximum number of lines in a file
 MAX_TOKENS = 128000  # maximum number of tokens in a file
+MAX_CHARS_PER_TOKEN = 8  # generous upper bound on average characters per token for code
+MAX_CHARS = MAX_TOKENS * MAX_CHARS_PER_TOKEN  # longer files can't fit in MAX_TOKENS
+BATCH_SIZE = 64  # number of files tokenized per call
+TOKEN_COUNT_CACHE_SIZE = 200_000  # distinct contents whose token counts are remembered
 
 # Lazy-load tokenizer to avoid import-time network requests
 _TOKENIZER: Optional[AutoTokenizer] = None
 
+# LRU cache of token counts keyed by a 64-bit content hash, so shared
+# boilerplate and duplicate files (BigQuery is not deduplicated) are
+# tokenized once
+_TOKEN_COUNT_CACHE: OrderedDict[int, int] = OrderedDict()
+_TOKEN_COUNT_CACHE_LOCK = threading.Lock()
+_BYTES_KEY_SEED = 1  # str contents are hashed with xxhash's default seed of 0
+
 
 def _get_tokenizer() -> AutoTokenizer:
     """Get or initialize the tokenizer (lazy loading)."""
     global _TOKENIZER
     if _TOKENIZER is None:
-        _TOKENIZER = AutoTokenizer.from_pretrained("meta-llama/Llama-3.2-3B")
+        _TOKENIZER = AutoTokenizer.from_pretrained("meta-llama/Llama-3.2-3B", use_fast=True)
     return _TOKENIZER
 
 
-def passes_filters(content: str) -> int | None:
+def _get_backend_tokenizer() -> Tokenizer:
+    """Get the Rust tokenizer behind the fast tokenizer, skipping the transformers wrapper."""
+    backend = _get_tokenizer().backend_tokenizer
+    # The wrapper resets truncation on every call; calling the backend directly
+    # must not inherit any truncation from tokenizer.json or counts are capped
+    if backend.truncation is not None:
+        backend.no_truncation()
+    return backend
+
+
+def _count_tokens(texts: list[str | bytes]) -> list[int]:
+    """Count tokens for each text, tokenizing only texts missing from the cache."""
+    # Raw bytes are tokenized as latin-1 but str as-is, so the same bytes can
+    # stand for different text; hashing them with a different seed keeps a
+    # UTF-8 str and its encoded bytes from sharing a count
+    keys = [
+        xxhash.xxh3_64_intdigest(text, seed=_BYTES_KEY_SEED)
+        if isinstance(text, bytes)
+        else xxhash.xxh3_64_intdigest(text.encode())
+        for text in texts
+    ]
+    
+    # Sources filter on their own threads and tokenization releases the GIL,
+    # so the cache is only touched under the lock and hits are copied out
+    # before tokenizing, in case another thread evicts them meanwhile
+    counts_by_key = {}
+    missing = {}
+    with _TOKEN_COUNT_CACHE_LOCK:
+        for key, text in zip(keys, texts):
+            if key in counts_by_key or key in missing:
+                continue
+            count = _TOKEN_COUNT_CACHE.get(key)
+            if count is None:
+                # Raw bytes are only decoded once they actually need tokenizing
+                missing[key] = text.decode("latin-1") if isinstance(text, bytes) else text
+            else:
+                _TOKEN_COUNT_CACHE.move_to_end(key)
+                counts_by_key[key] = count
+    
+    if missing:
+        # encode_batch_fast parallelizes across the batch in Rust and skips
+        # the offset tracking we don't need
+        encodings = _get_backend_tokenizer().encode_batch_fast(
+            list(missing.values()), add_special_tokens=False
+        )
+        new_counts = {key: len(encoding) for key, encoding in zip(missing, encodings)}
+        counts_by_key.update(new_counts)
+        
+        with _TOKEN_COUNT_CACHE_LOCK:
+            _TOKEN_COUNT_CACHE.update(new_counts)
+            while len(_TOKEN_COUNT_CACHE) > TOKEN_COUNT_CACHE_SIZE:
+                _TOKEN_COUNT_CACHE.popitem(last=False)
+    
+    return [counts_by_key[key] for key in keys]
+
+
+def _count_lines(content: str | bytes) -> int:
+    """Count lines as len(content.splitlines()) would for newline-separated content."""
+    newline = b"\n" if isinstance(content, bytes) else "\n"
+    return content.count(newline) + (0 if content.endswith(newline) else 1)
+
+
+def _cheap_filter_mask(contents: list[str | bytes]) -> np.ndarray:
+    """Check the length and line-count filters, which don't need the tokenizer, for a whole batch."""
+    n = len(contents)
+    
+    # A file needs at least one character per line, and anything longer than
+    # MAX_CHARS is rejected before paying for a newline count or tokenization
+    lengths = np.fromiter(
+        (len(content) if content else 0 for content in contents), dtype=np.int64, count=n
+    )
+    length_ok = (lengths >= MIN_LINES) & (lengths <= MAX_CHARS)
+    
+    # Count newlines in C rather than materializing a list of lines; a final
+    # line without a trailing newline still counts, matching len(splitlines())
+    num_lines = np.fromiter(
+        (
+            _count_lines(content) if ok else 0
+            for content, ok in zip(contents, length_ok.tolist())
+        ),
+        dtype=np.int64,
+        count=n,
+    )
+    return length_ok & (num_lines >= MIN_LINES) & (num_lines <= MAX_LINES)
+
+
+def passes_filters(content: str | bytes) -> int | None:
     """
     Returns token count if content passes filters, otherwise returns None.
     
@@ -31,22 +133,37 @@ def passes_filters(content: str) -> int | None:
     Returns:
         Token count (int) if content passes all filters, None otherwise
     """
-    if not content:
-        return None
+    # Share the batched path, which only asks the tokenizer for lengths rather
+    # than materializing a list of token strings just to count them
+    return passes_filters_batch([content])[0]
+
+
+def passes_filters_batch(contents: list[str | bytes]) -> list[int | None]:
+    """
+    Batched version of passes_filters.
     
-    # Check line count
-    lines = content.splitlines()
-    num_lines = len(lines)
+    Files passing the line filter are tokenized together in one call so the
+    fast (Rust) tokenizer can spread the batch across cores.
     
-    if not (MIN_LINES <= num_lines <= MAX_LINES):
-        return None
+    Args:
+        contents: The file contents to check; raw bytes are treated as
+            latin-1, so their lengths match the decoded text's
+        
+    Returns:
+        Token count (int) or None for each content, in input order
+    """
+    results: list[int | None] = [None] * len(contents)
+    
+    # Check length and line count
+    candidates = np.flatnonzero(_cheap_filter_mask(contents)).tolist()
+    if not candidates:
+        return results
     
     # Check token count
-    tokenizer = _get_tokenizer()
-    num_tokens = len(tokenizer.tokenize(content))
+    lengths = _count_tokens([contents[i] for i in candidates])
     
-    if num_tokens > MAX_TOKENS:
-        return None
+    for i, num_tokens in zip(candidates, lengths):
+        if num_tokens <= MAX_TOKENS:
+            results[i] = num_tokens
     
-    return num_tokens
-
+    return results
@@ -1,10 +1,11 @@
 """License classification utilities."""
 
+import re
 from typing import Optional
 
 # Set of permissive license SPDX IDs from The Stack v2 license_stats.csv
 # Based on Blue Oak Council and ScanCode permissive/public domain licenses
-PERMISSIVE_LICENSE_SPDX_IDS = {
+PERMISSIVE_LICENSE_SPDX_IDS = frozenset({
     "0BSD", "AAL", "AdaCore-doc", "Adobe-2006", "Adobe-Glyph", "ADSL",
     "AFL-1.1", "AFL-1.2", "AFL-2.0", "AFL-2.1", "AFL-3.0", "AML", "AMPAS",
     "ANTLR-PD", "Apache-1.0", "Apache-1.1", "Apache-2.0", "APAFML",
@@ -60,15 +61,24 @@ PERMISSIVE_LICENSE_SPDX_IDS = {
     "zlib-acknowledgement", "ZPL-1.1", "ZPL-2.0", "ZPL-2.1",
     # Also include LicenseRef-scancode-* variants that are permissive
     # (Many are listed in the CSV but we'll check by prefix for common ones)
-}
+})
 
 # Also add common lowercase variations and common names
-PERMISSIVE_LICENSE_NAMES = {
+PERMISSIVE_LICENSE_NAMES = frozenset({
     "mit", "apache-2.0", "apache 2.0", "apache2", "bsd", "isc", "unlicense",
     "wtfpl", "zlib", "public domain", "public-domain", "cc0", "cc0-1.0",
     "bsd-2-clause", "bsd-3-clause", "bsd-4-clause", "artistic-2.0",
     "python-2.0", "postgresql", "json", "curl", "openssl",
-}
+})
+
+# Lowercased SPDX IDs for case-insensitive lookups
+_PERMISSIVE_SPDX_IDS_LOWER = frozenset(
+    spdx_id.lower() for spdx_id in PERMISSIVE_LICENSE_SPDX_IDS
+)
+
+# Fallback patterns for license names not in the lists above: MIT/Apache
+# anywhere in the name, or a BSD prefix, checked in a single scan
+_PERMISSIVE_PATTERN = re.compile(r"mit|apache|^bsd")
 
 
 def classify_license_type(license_name: Optional[str]) -> str:
@@ -97,20 +107,11 @@ def classify_license_type(license_name: Optional[str]) -> str:
         return "permissive"
     
     # Check if it's in the permissive set (case-insensitive)
-    for perm_license in PERMISSIVE_LICENSE_SPDX_IDS:
-        if perm_license.lower() == license_lower:
-            return "permissive"
+    if license_lower in _PERMISSIVE_SPDX_IDS_LOWER:
+        return "permissive"
     
     # Check common patterns
-    if any(
-        pattern in license_lower
-        for pattern in ["mit", "apache", "bsd", "isc", "unlicense", "wtfpl"]
-    ):
-        # More specific check for common patterns
-        if "mit" in license_lower or "apache" in license_lower:
-            return "permissive"
-        if license_lower.startswith("bsd"):
-            return "permissive"
+    if _PERMISSIVE_PATTERN.search(license_lower):
+        return "permissive"
     
     return "no_license"
-
@@ -1,48 +1,136 @@
 """Script to combine multiple ingestion sources into a single JSONL file."""
 
 import argparse
-import json
+import os
+import queue
+import threading
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
+import orjson
 from loguru import logger
 
 from ingestion.bigquery import load_bigquery
 from ingestion.stack import load_stack
 
 
-def build_dataset(output_path: str, languages: list[str] = None, include_bigquery: bool = False):
+WRITE_BATCH_BYTES = 1 << 20  # serialized bytes buffered before each write
+# Rows buffered between the source threads and the writer; rows can be up to
+# MAX_CHARS (~1 MB) each, so this keeps the worst case in the tens of MB
+QUEUE_MAX_ROWS = 32
+
+# Queued by each source thread once it has no more rows
+_DONE = object()
+
+
+def _write_rows(fout, rows) -> int:
+    """Write rows to a JSONL file opened in binary mode and return the count."""
+    count = 0
+    buffer = bytearray()
+    for row in rows:
+        # orjson serializes straight to UTF-8 bytes, several times faster than
+        # json, and appends the newline itself instead of a separate concat
+        buffer += orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE)
+        count += 1
+        
+        # One write per ~1 MiB amortizes the per-call I/O overhead; a fixed
+        # byte budget also bounds memory however large the files are
+        if len(buffer) >= WRITE_BATCH_BYTES:
+            fout.write(buffer)
+            buffer.clear()
+    
+    if buffer:
+        fout.write(buffer)
+    return count
+
+
+def _produce(load: Callable[[], Iterable[dict]], rows_queue: queue.Queue, stop: threading.Event) -> int:
+    """Feed one source's rows into the writer queue and return how many were queued."""
+    count = 0
+    try:
+        for row in load():
+            if stop.is_set():
+                break
+            rows_queue.put(row)
+            count += 1
+    except BaseException:
+        # Stop the other sources early; the error is re-raised from the future
+        stop.set()
+        raise
+    finally:
+        rows_queue.put(_DONE)
+    return count
+
+
+def _queued_rows(rows_queue: queue.Queue, num_sources: int) -> Iterator[dict]:
+    """Yield queued rows until every source has finished."""
+    remaining = num_sources
+    while remaining:
+        row = rows_queue.get()
+        if row is _DONE:
+            remaining -= 1
+        else:
+            yield row
+
+
+def build_dataset(
+    output_path: str,
+    languages: list[str] = None,
+    include_bigquery: bool = False,
+    num_workers: int = 1,
+):
     """
     Combine multiple ingestion sources into a single JSONL file.
     
+    Sources are read concurrently, one thread each, and their rows are
+    interleaved in the output as they arrive.
+    
     Args:
         output_path: Path to write the output JSONL file
         languages: List of languages to ingest from Stack v2 (default: ["COBOL", "REXX", "RPGLE"])
         include_bigquery: Whether to include BigQuery ingestion
+        num_workers: Number of processes used to decode and filter BigQuery rows
     """
     if languages is None:
         languages = ["COBOL", "REXX", "RPGLE"]
     
-    all_rows = []
-    
-    # Load from Stack v2
+    sources = []
     for language in languages:
         logger.info(f"Loading {language} from Stack v2...")
-        rows = list(load_stack(language))
-        all_rows.extend(rows)
-        logger.info(f"Added {len(rows)} {language} files")
-    
-    # Load from BigQuery if requested
+        sources.append((language, partial(load_stack, language)))
     if include_bigquery:
         logger.info("Loading data from BigQuery...")
-        rows = list(load_bigquery())
-        all_rows.extend(rows)
-        logger.info(f"Added {len(rows)} BigQuery files")
+        sources.append(("BigQuery", partial(load_bigquery, num_workers=num_workers)))
     
-    # Write to JSONL
-    logger.info(f"Writing {len(all_rows)} total rows to {output_path}...")
-    with open(output_path, "w") as fout:
-        for row in all_rows:
-            fout.write(json.dumps(row) + "\n")
+    # Sources are mostly waiting on the network, so each gets its own thread;
+    # a single writer drains the bounded queue so the file needs no locking
+    rows_queue = queue.Queue(maxsize=QUEUE_MAX_ROWS)
+    stop = threading.Event()
+    # Batches are already WRITE_BATCH_BYTES, so they bypass the file's own
+    # buffer and go straight to the OS
+    with open(output_path, "wb", buffering=WRITE_BATCH_BYTES) as fout, \
+            ThreadPoolExecutor(max_workers=max(len(sources), 1)) as executor:
+        futures = [
+            (name, executor.submit(_produce, load, rows_queue, stop)) for name, load in sources
+        ]
+        
+        try:
+            total = _write_rows(fout, _queued_rows(rows_queue, len(sources)))
+        except BaseException:
+            # Unblock any source waiting on a full queue so the threads can exit
+            stop.set()
+            while not all(future.done() for _, future in futures):
+                try:
+                    rows_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            raise
+        
+        for name, future in futures:
+            logger.info(f"Added {future.result()} {name} files")
     
+    logger.info(f"Wrote {total} total rows to {output_path}")
     logger.info(f"Dataset built successfully: {output_path}")
 
 
@@ -67,6 +155,12 @@ if __name__ == "__main__":
         action="store_true",
         help="Include BigQuery ingestion"
     )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Processes used to decode and filter BigQuery rows"
+    )
     
     args = parser.parse_args()
     
@@ -74,5 +168,6 @@ if __name__ == "__main__":
         output_path=args.output,
         languages=args.languages,
         include_bigquery=args.include_bigquery,
+        num_workers=args.num_workers,
     )
 
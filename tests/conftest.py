@@ -1,11 +1,29 @@
 """Pytest configuration and shared fixtures."""
 
 import os
+import sys
+import tempfile
+from datetime import datetime
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
+import pyarrow as pa
 import pytest
 
 
+@pytest.fixture(autouse=True, scope="session")
+def ram_backed_tmpdir():
+    """Put temporary files (including tmp_path) on tmpfs when running on Linux."""
+    if sys.platform != "linux" or not os.access("/dev/shm", os.W_OK):
+        yield
+        return
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setenv("TMPDIR", "/dev/shm")
+        # tempfile caches the directory it resolved, so make it look again
+        mp.setattr(tempfile, "tempdir", None)
+        yield
+
+
 @pytest.fixture(autouse=True)
 def reset_env():
     """Reset environment variables before each test."""
@@ -22,20 +40,58 @@ def mock_tokenizer():
     """Mock the tokenizer to avoid HuggingFace API calls during tests."""
     # Create a mock tokenizer
     mock_tok = MagicMock()
-    # Make tokenize return a list of tokens based on word count (simple approximation)
+    # Tokenize into words (simple approximation of a real tokenizer)
     def mock_tokenize(text):
         # Simple approximation: split by whitespace
         return text.split() if text else []
-    mock_tok.tokenize = mock_tokenize
+    # The Rust backend returns one encoding per text; its len() is the token count
+    mock_tok.backend_tokenizer.truncation = None
+    mock_tok.backend_tokenizer.encode_batch_fast.side_effect = (
+        lambda texts, **kwargs: [mock_tokenize(text) for text in texts]
+    )
     
     # Mock AutoTokenizer.from_pretrained to return our mock
     with patch("processing.filters.AutoTokenizer.from_pretrained", return_value=mock_tok):
-        # Also reset the global tokenizer cache
+        # Also reset the global tokenizer and token count caches
         import processing.filters
         processing.filters._TOKENIZER = None
+        processing.filters._TOKEN_COUNT_CACHE.clear()
         yield mock_tok
         # Reset after test
         processing.filters._TOKENIZER = None
+        processing.filters._TOKEN_COUNT_CACHE.clear()
+
+
+@pytest.fixture(autouse=True)
+def reset_stack_dataset_cache():
+    """Reset the cached Stack v2 datasets so each test sees its own mock."""
+    import ingestion.stack
+    ingestion.stack._get_dataset.cache_clear()
+    yield
+    ingestion.stack._get_dataset.cache_clear()
+
+
+@pytest.fixture(scope="session")
+def stack_dataset_mock():
+    """Factory for a one-row Stack v2 dataset; keyword arguments override fields of the row."""
+    base_row = {
+        "blob_id": "test-blob-id",
+        "src_encoding": "utf-8",
+        "detected_licenses": ["MIT"],
+        "license_type": "MIT",
+        "repo_name": "test/repo",
+        "path": "test/file.cob",
+        "language": "COBOL",
+        "extension": ".cob",
+        "branch_name": "main",
+        "revision_id": "abc123",
+        "committer_date": datetime(2024, 1, 1),
+    }
+    
+    def make(**overrides):
+        return [{**base_row, **overrides}]
+    
+    return make
 
 
 @pytest.fixture
@@ -45,6 +101,38 @@ def mock_hf_token():
         yield "test-hf-token"
 
 
+@pytest.fixture
+def mock_hf_upload(mock_hf_token, tmp_path):
+    """Patch the Hub client, dataset loading and schema alignment used by upload_to_hf."""
+    # The card an existing repo serves, as push_to_hub leaves it
+    card_path = tmp_path / "README.md"
+    card_path.write_text(
+        "---\n"
+        "license: mit\n"
+        "dataset_info:\n"
+        "  splits:\n"
+        "  - name: train\n"
+        "    num_examples: 2\n"
+        "---\n"
+        "\n"
+        "# Test dataset\n"
+        "\n"
+        "Existing description.\n"
+    )
+    with patch("upload.HfApi") as mock_hf_api, \
+            patch("upload.load_dataset") as mock_load_dataset, \
+            patch("upload._read_shard_schema") as mock_read_shard_schema, \
+            patch("upload._align_to_schema", side_effect=lambda dataset, schema: dataset) as mock_align:
+        mock_hf_api.return_value.hf_hub_download.return_value = str(card_path)
+        yield SimpleNamespace(
+            hf_api=mock_hf_api,
+            api=mock_hf_api.return_value,
+            load_dataset=mock_load_dataset,
+            read_shard_schema=mock_read_shard_schema,
+            align_to_schema=mock_align,
+        )
+
+
 @pytest.fixture
 def mock_aws_credentials():
     """Mock AWS credentials for testing."""
@@ -61,12 +149,37 @@ def mock_aws_credentials():
 
 @pytest.fixture(autouse=True)
 def mock_bigquery_client():
-    """Mock BigQuery client to avoid credential checks during tests."""
-    with patch("ingestion.bigquery.bigquery.Client") as mock_client_class:
-        # Reset the global client cache
+    """Mock BigQuery clients to avoid credential checks during tests."""
+    with patch("ingestion.bigquery.bigquery.Client") as mock_client_class, \
+            patch("ingestion.bigquery.bigquery_storage.BigQueryReadClient"):
+        # Reset the global client caches
         import ingestion.bigquery
         ingestion.bigquery._client = None
+        ingestion.bigquery._bqstorage_client = None
         yield mock_client_class
         # Reset after test
         ingestion.bigquery._client = None
+        ingestion.bigquery._bqstorage_client = None
 
+
+
+@pytest.fixture
+def bq_client():
+    """Factory for a BigQuery client whose query streams the given rows as Arrow record batches."""
+    def record_batch(rows) -> pa.RecordBatch:
+        # The shape the Storage Read API returns for the ingestion query
+        return pa.RecordBatch.from_pydict({
+            "repo_name": [row.repo_name for row in rows],
+            "path": [row.path for row in rows],
+            "content": [row.content for row in rows],
+            "license": pa.array([row.license for row in rows], type=pa.string()),
+        })
+    
+    def make(*batches):
+        client = MagicMock()
+        client.query.return_value.result.return_value.to_arrow_iterable.return_value = [
+            record_batch(rows) for rows in batches
+        ]
+        return client
+    
+    return make
@@ -1,206 +1,271 @@
 """Tests for ingestion/bigquery.py"""
 
-import base64
-from unittest.mock import MagicMock, patch
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from unittest.mock import patch
 
+import pybase64
 import pytest
 
-from ingestion.bigquery import load_bigquery
+from ingestion.bigquery import QUERY_PAGE_SIZE, load_bigquery
+from processing.filters import MAX_CHARS
+
+# Encoded payloads shared across tests (base64 output is always ASCII)
+_VALID_B64 = pybase64.b64encode_as_string(b"test content\n" * 20)
+_LATIN1_B64 = pybase64.b64encode_as_string(
+    ("test content with some bytes: \x80\x81\x82\n" * 20).encode("latin-1")
+)
+
+
+@dataclass(slots=True, frozen=True)
+class BqRow:
+    """A row of the ingestion query's result."""
+    repo_name: str
+    path: str
+    content: str | None
+    license: str | None
 
 
 class TestLoadBigQuery:
     """Test the load_bigquery function."""
     
+    @pytest.mark.parametrize(
+        "content_b64, license, filter_result, expected, tokenized",
+        [
+            pytest.param(
+                _VALID_B64, "MIT", 150,
+                {"license_type": "permissive", "licenses": ["MIT"], "num_tokens": 150},
+                True,
+                id="success",
+            ),
+            pytest.param(
+                pybase64.b64encode_as_string(b"test content"), "MIT", None, None, True,
+                id="filters_out_invalid_content",
+            ),
+            pytest.param(
+                # Invalid base64 fails to decode, so the row never reaches the filters
+                "!!!invalid base64!!!", "MIT", None, None, False,
+                id="handles_decode_error",
+            ),
+            pytest.param(
+                # BigQuery stores no content for large files, so it comes back NULL
+                None, "MIT", None, None, False,
+                id="handles_null_content",
+            ),
+            pytest.param(
+                # BigQuery doesn't have commit info
+                _VALID_B64, "MIT", 200,
+                {"num_tokens": 200, "revision_id": "", "commit_date": "", "branch": ""},
+                True,
+                id="schema",
+            ),
+            pytest.param(
+                _VALID_B64, None, 150, {"license_type": "no_license", "licenses": []}, True,
+                id="handles_missing_license",
+            ),
+            pytest.param(
+                # Content with bytes that might have issues with utf-8
+                _LATIN1_B64, "MIT", 150,
+                {"content": "test content with some bytes: \x80\x81\x82\n" * 20},
+                True,
+                id="latin1_encoding",
+            ),
+        ],
+    )
     @patch("ingestion.bigquery._get_client")
-    @patch("ingestion.bigquery.passes_filters")
-    def test_load_bigquery_success(self, mock_passes_filters, mock_get_client):
-        """Test successful BigQuery loading."""
-        # Mock BigQuery result row
-        mock_row = MagicMock()
-        mock_row.repo_name = "test/repo"
-        mock_row.path = "test/file.jcl"
-        mock_row.content = base64.b64encode(("test content\n" * 20).encode("utf-8")).decode("utf-8")
-        mock_row.license = "MIT"
-        
-        # Mock query result
-        mock_result = MagicMock()
-        mock_result.__iter__ = MagicMock(return_value=iter([mock_row]))
-        mock_query_job = MagicMock()
-        mock_query_job.result.return_value = mock_result
-        mock_client = MagicMock()
-        mock_client.query.return_value = mock_query_job
-        mock_get_client.return_value = mock_client
-        
-        # Mock filter passing
-        mock_passes_filters.return_value = 150  # Token count
+    @patch("ingestion.bigquery.passes_filters_batch")
+    def test_load_bigquery_single_row(
+        self, mock_passes_filters, mock_get_client, bq_client,
+        content_b64, license, filter_result, expected, tokenized,
+    ):
+        """Test decoding, filtering and normalizing a single BigQuery row."""
+        mock_row = BqRow(
+            repo_name="test/repo",
+            path="test/file.jcl",
+            content=content_b64,
+            license=license,
+        )
+        mock_get_client.return_value = bq_client([mock_row])
+        mock_passes_filters.side_effect = lambda contents: [filter_result] * len(contents)
         
         results = list(load_bigquery())
         
+        assert mock_passes_filters.called == tokenized
+        if tokenized:
+            # Filters see the raw bytes; only passing rows are decoded to text
+            assert isinstance(mock_passes_filters.call_args[0][0][0], bytes)
+        if expected is None:
+            assert len(results) == 0
+            return
+        
         assert len(results) == 1
         result = results[0]
+        
+        # Check required schema fields (matching HuggingFace dataset schema)
+        required_fields = [
+            "content", "repo_name", "file_path", "language", "extension",
+            "license_type", "licenses", "host_url", "source",
+            "num_tokens", "revision_id", "commit_date", "branch"
+        ]
+        for field in required_fields:
+            assert field in result, f"Missing required field: {field}"
+        
         assert result["repo_name"] == "test/repo"
         assert result["file_path"] == "test/file.jcl"
         assert result["language"] == "JCL"  # Language inferred from .jcl extension
         assert result["extension"] == "jcl"
-        assert result["license_type"] == "permissive"  # MIT is a permissive license
-        assert result["licenses"] == ["MIT"]
         assert result["source"] == "bigquery"
-        assert result["num_tokens"] == 150
         assert result["host_url"] == "https://github.com"
-        assert "content" in result
+        for field, value in expected.items():
+            assert result[field] == value
     
     @patch("ingestion.bigquery._get_client")
-    @patch("ingestion.bigquery.passes_filters")
-    def test_load_bigquery_filters_out_invalid_content(self, mock_passes_filters, mock_get_client):
-        """Test that content failing filters is excluded."""
-        mock_row = MagicMock()
-        mock_row.repo_name = "test/repo"
-        mock_row.path = "test/file.jcl"
-        mock_row.content = base64.b64encode("test content".encode("utf-8")).decode("utf-8")
-        mock_row.license = "MIT"
-        
-        mock_result = MagicMock()
-        mock_result.__iter__ = MagicMock(return_value=iter([mock_row]))
-        mock_query_job = MagicMock()
-        mock_query_job.result.return_value = mock_result
-        mock_client = MagicMock()
-        mock_client.query.return_value = mock_query_job
-        mock_get_client.return_value = mock_client
+    @patch("ingestion.bigquery.passes_filters_batch")
+    def test_load_bigquery_preserves_non_ascii(self, mock_passes_filters, mock_get_client, bq_client):
+        """Test that non-ASCII bytes such as the PL/I NOT sign are decoded losslessly."""
+        content = "IF A \xac= B THEN CALL X;\n" * 20
+        
+        mock_row = BqRow(
+            repo_name="test/repo",
+            path="test/file.pli",
+            content=pybase64.b64encode_as_string(content.encode("latin-1")),
+            license="MIT",
+        )
         
-        # Mock filter failing
-        mock_passes_filters.return_value = None
+        mock_get_client.return_value = bq_client([mock_row])
+        
+        mock_passes_filters.side_effect = lambda contents: [150] * len(contents)
         
         results = list(load_bigquery())
         
-        # Should be empty since content failed filters
-        assert len(results) == 0
+        assert len(results) == 1
+        assert results[0]["content"] == content
     
     @patch("ingestion.bigquery._get_client")
-    @patch("ingestion.bigquery.passes_filters")
-    def test_load_bigquery_handles_decode_error(self, mock_passes_filters, mock_get_client):
-        """Test that decode errors are handled gracefully."""
-        import base64
-        mock_row = MagicMock()
-        mock_row.repo_name = "test/repo"
-        mock_row.path = "test/file.jcl"
-        # Use base64 that will fail to decode properly
-        mock_row.content = "!!!invalid base64!!!"  # Invalid base64 - will decode but may fail filters
-        mock_row.license = "MIT"
-        
-        mock_result = MagicMock()
-        mock_result.__iter__ = MagicMock(return_value=iter([mock_row]))
-        mock_query_job = MagicMock()
-        mock_query_job.result.return_value = mock_result
-        mock_client = MagicMock()
-        mock_client.query.return_value = mock_query_job
-        mock_get_client.return_value = mock_client
+    @patch("ingestion.bigquery.passes_filters_batch")
+    def test_load_bigquery_extension_case_insensitive(self, mock_passes_filters, mock_get_client, bq_client):
+        """Test that the extension is taken from the last dot and lowercased."""
+        mock_row = BqRow(
+            repo_name="test/repo",
+            path="test.dir/FILE.PLI",
+            content=_VALID_B64,
+            license="MIT",
+        )
+        
+        mock_get_client.return_value = bq_client([mock_row])
         
-        # Mock filter to fail (content decoded but likely doesn't pass filters)
-        mock_passes_filters.return_value = None
+        mock_passes_filters.side_effect = lambda contents: [150] * len(contents)
         
         results = list(load_bigquery())
         
-        # Should skip content that fails to decode
-        assert len(results) == 0
-        # Verify passes_filters was not called because decode failed
-        mock_passes_filters.assert_not_called()
+        assert len(results) == 1
+        assert results[0]["extension"] == "pli"
+        assert results[0]["language"] == "PL/I"
     
     @patch("ingestion.bigquery._get_client")
-    @patch("ingestion.bigquery.passes_filters")
-    def test_load_bigquery_schema(self, mock_passes_filters, mock_get_client):
-        """Test that load_bigquery yields rows with correct schema."""
-        mock_row = MagicMock()
-        mock_row.repo_name = "test/repo"
-        mock_row.path = "test/file.jcl"
-        mock_row.content = base64.b64encode(("test content\n" * 20).encode("utf-8")).decode("utf-8")
-        mock_row.license = "MIT"
-        
-        mock_result = MagicMock()
-        mock_result.__iter__ = MagicMock(return_value=iter([mock_row]))
-        mock_query_job = MagicMock()
-        mock_query_job.result.return_value = mock_result
-        mock_client = MagicMock()
-        mock_client.query.return_value = mock_query_job
-        mock_get_client.return_value = mock_client
+    @patch("ingestion.bigquery.passes_filters_batch")
+    def test_load_bigquery_language_lookup_is_constant_time(self, mock_passes_filters, mock_get_client, bq_client):
+        """Test that each row's language is one map lookup rather than a scan of the extensions."""
+        class LookupOnlyMap(dict):
+            gets = 0
+            
+            def get(self, *args):
+                LookupOnlyMap.gets += 1
+                return super().get(*args)
+            
+            def __iter__(self):
+                raise AssertionError("extension map should not be scanned")
+            
+            def items(self):
+                raise AssertionError("extension map should not be scanned")
         
-        mock_passes_filters.return_value = 200
+        rows = [
+            BqRow(repo_name="test/repo", path=path, content=_VALID_B64, license="MIT")
+            for path in ["a.jcl", "b.PLI", "c.hlasm", "d.bms"]
+        ]
+        mock_get_client.return_value = bq_client(rows)
+        mock_passes_filters.side_effect = lambda contents: [150] * len(contents)
         
-        results = list(load_bigquery())
+        import ingestion.bigquery
+        with patch.object(ingestion.bigquery, "_EXT_TO_LANG", LookupOnlyMap(ingestion.bigquery._EXT_TO_LANG)):
+            results = list(load_bigquery())
         
-        assert len(results) == 1
-        result = results[0]
+        assert [r["language"] for r in results] == ["JCL", "PL/I", "HLASM", "BMS"]
+        assert LookupOnlyMap.gets == len(rows)
+    
+    @patch("ingestion.bigquery.pybase64.b64decode")
+    @patch("ingestion.bigquery._get_client")
+    @patch("ingestion.bigquery.passes_filters_batch")
+    def test_load_bigquery_rejects_by_length_without_decoding(self, mock_passes_filters, mock_get_client, mock_b64decode, bq_client):
+        """Test that content outside the length bounds is skipped before base64 decoding."""
+        too_long = BqRow(
+            repo_name="test/repo",
+            path="test/big.jcl",
+            content="A" * ((MAX_CHARS // 3 + 1) * 4),
+            license="MIT",
+        )
+        too_short = BqRow(
+            repo_name="test/repo",
+            path="test/small.jcl",
+            content=pybase64.b64encode_as_string(b"short"),
+            license="MIT",
+        )
+        mock_get_client.return_value = bq_client([too_long, too_short])
         
-        # Check required schema fields (matching HuggingFace dataset schema)
-        required_fields = [
-            "content", "repo_name", "file_path", "language", "extension",
-            "license_type", "licenses", "host_url", "source",
-            "num_tokens", "revision_id", "commit_date", "branch"
-        ]
-        for field in required_fields:
-            assert field in result, f"Missing required field: {field}"
+        results = list(load_bigquery())
         
-        assert result["source"] == "bigquery"
-        assert result["language"] == "JCL"  # Language inferred from .jcl extension
-        assert result["extension"] == "jcl"
-        assert result["host_url"] == "https://github.com"
-        # BigQuery doesn't have commit info
-        assert result["revision_id"] == ""
-        assert result["commit_date"] == ""
-        assert result["branch"] == ""
+        assert len(results) == 0
+        mock_b64decode.assert_not_called()
+        mock_passes_filters.assert_not_called()
     
+    @patch("ingestion.bigquery._get_bqstorage_client")
     @patch("ingestion.bigquery._get_client")
-    @patch("ingestion.bigquery.passes_filters")
-    def test_load_bigquery_handles_missing_license(self, mock_passes_filters, mock_get_client):
-        """Test that missing license defaults to 'unknown'."""
-        mock_row = MagicMock()
-        mock_row.repo_name = "test/repo"
-        mock_row.path = "test/file.jcl"
-        mock_row.content = base64.b64encode(("test content\n" * 20).encode("utf-8")).decode("utf-8")
-        mock_row.license = None  # No license
-        
-        mock_result = MagicMock()
-        mock_result.__iter__ = MagicMock(return_value=iter([mock_row]))
-        mock_query_job = MagicMock()
-        mock_query_job.result.return_value = mock_result
-        mock_client = MagicMock()
-        mock_client.query.return_value = mock_query_job
+    @patch("ingestion.bigquery.passes_filters_batch")
+    def test_load_bigquery_uses_storage_api(self, mock_passes_filters, mock_get_client, mock_get_bqstorage_client, bq_client):
+        """Test that results are paged and streamed as Arrow batches over the Storage Read API."""
+        mock_row = BqRow(
+            repo_name="test/repo",
+            path="test/file.jcl",
+            content=_VALID_B64,
+            license="MIT",
+        )
+        mock_client = bq_client([mock_row])
         mock_get_client.return_value = mock_client
         
-        mock_passes_filters.return_value = 150
+        mock_passes_filters.side_effect = lambda contents: [150] * len(contents)
         
         results = list(load_bigquery())
         
         assert len(results) == 1
-        assert results[0]["license_type"] == "no_license"  # No license provided
-        assert results[0]["licenses"] == []
+        mock_result = mock_client.query.return_value.result
+        mock_result.assert_called_once_with(page_size=QUERY_PAGE_SIZE)
+        mock_result.return_value.to_arrow_iterable.assert_called_once_with(
+            bqstorage_client=mock_get_bqstorage_client.return_value
+        )
     
     @patch("ingestion.bigquery._get_client")
-    @patch("ingestion.bigquery.passes_filters")
-    def test_load_bigquery_latin1_encoding(self, mock_passes_filters, mock_get_client):
-        """Test that content is decoded using latin-1 encoding."""
-        # Create content that might have issues with utf-8
-        content = "test content with some bytes: \x80\x81\x82\n" * 20
-        encoded = base64.b64encode(content.encode("latin-1")).decode("utf-8")
-        
-        mock_row = MagicMock()
-        mock_row.repo_name = "test/repo"
-        mock_row.path = "test/file.jcl"
-        mock_row.content = encoded
-        mock_row.license = "MIT"
-        
-        mock_result = MagicMock()
-        mock_result.__iter__ = MagicMock(return_value=iter([mock_row]))
-        mock_query_job = MagicMock()
-        mock_query_job.result.return_value = mock_result
-        mock_client = MagicMock()
-        mock_client.query.return_value = mock_query_job
-        mock_get_client.return_value = mock_client
+    @patch("ingestion.bigquery.passes_filters_batch")
+    def test_load_bigquery_with_workers_preserves_order(self, mock_passes_filters, mock_get_client, bq_client):
+        """Test that batches fanned out to workers are yielded in query order."""
+        rows = []
+        for i in range(200):
+            mock_row = BqRow(
+                repo_name=f"test/repo{i}",
+                path="test/file.jcl",
+                content=_VALID_B64,
+                license="MIT",
+            )
+            rows.append(mock_row)
         
-        mock_passes_filters.return_value = 150
+        mock_get_client.return_value = bq_client(rows[:150], rows[150:])
         
-        results = list(load_bigquery())
+        mock_passes_filters.side_effect = lambda contents: [150] * len(contents)
         
-        assert len(results) == 1
-        # Content should be decoded successfully
-        assert "test content" in results[0]["content"]
-
+        # Threads stand in for processes so the patched filter is visible to workers
+        with patch(
+            "ingestion.bigquery.ProcessPoolExecutor",
+            lambda max_workers, **kwargs: ThreadPoolExecutor(max_workers),
+        ):
+            results = list(load_bigquery(num_workers=2))
+        
+        assert [r["repo_name"] for r in results] == [f"test/repo{i}" for i in range(200)]
@@ -1,13 +1,18 @@
 """Tests for scripts/build_dataset.py"""
 
-import json
-import tempfile
-from pathlib import Path
-from unittest.mock import MagicMock, patch
+import math
+from unittest.mock import MagicMock, mock_open, patch
 
+import orjson
 import pytest
 
-from scripts.build_dataset import build_dataset
+from scripts.build_dataset import WRITE_BATCH_BYTES, build_dataset
+
+
+def _read_jsonl(path) -> list[dict]:
+    """Parse a JSONL file line by line in binary mode; orjson reads the bytes directly."""
+    with open(path, "rb") as f:
+        return [orjson.loads(line) for line in f]
 
 
 class TestBuildDataset:
@@ -15,7 +20,7 @@ class TestBuildDataset:
     
     @patch("scripts.build_dataset.load_stack")
     @patch("scripts.build_dataset.load_bigquery")
-    def test_build_dataset_stack_only(self, mock_load_bigquery, mock_load_stack):
+    def test_build_dataset_stack_only(self, mock_load_bigquery, mock_load_stack, tmp_path):
         """Test building dataset from Stack v2 only."""
         # Mock stack data
         mock_stack_data = [
@@ -32,27 +37,24 @@ class TestBuildDataset:
         ]
         mock_load_stack.return_value = iter(mock_stack_data)
         
-        with tempfile.TemporaryDirectory() as tmpdir:
-            output_path = Path(tmpdir) / "test.jsonl"
-            build_dataset(str(output_path), languages=["COBOL"], include_bigquery=False)
-            
-            # Verify file was created
-            assert output_path.exists()
-            
-            # Verify content
-            with open(output_path) as f:
-                lines = f.readlines()
-                assert len(lines) == 1
-                row = json.loads(lines[0])
-                assert row["source"] == "stack"
-                assert row["repo_name"] == "repo1"
-            
-            mock_load_stack.assert_called_once_with("COBOL")
-            mock_load_bigquery.assert_not_called()
+        output_path = tmp_path / "test.jsonl"
+        build_dataset(str(output_path), languages=["COBOL"], include_bigquery=False)
+        
+        # Verify file was created
+        assert output_path.exists()
+        
+        # Verify content
+        rows = _read_jsonl(output_path)
+        assert len(rows) == 1
+        assert rows[0]["source"] == "stack"
+        assert rows[0]["repo_name"] == "repo1"
+        
+        mock_load_stack.assert_called_once_with("COBOL")
+        mock_load_bigquery.assert_not_called()
     
     @patch("scripts.build_dataset.load_stack")
     @patch("scripts.build_dataset.load_bigquery")
-    def test_build_dataset_with_bigquery(self, mock_load_bigquery, mock_load_stack):
+    def test_build_dataset_with_bigquery(self, mock_load_bigquery, mock_load_stack, tmp_path):
         """Test building dataset with BigQuery included."""
         # Mock stack data
         mock_stack_data = [
@@ -85,33 +87,28 @@ class TestBuildDataset:
         ]
         mock_load_bigquery.return_value = iter(mock_bigquery_data)
         
-        with tempfile.TemporaryDirectory() as tmpdir:
-            output_path = Path(tmpdir) / "test.jsonl"
-            build_dataset(
-                str(output_path),
-                languages=["COBOL"],
-                include_bigquery=True
-            )
-            
-            # Verify file was created
-            assert output_path.exists()
-            
-            # Verify content
-            with open(output_path) as f:
-                lines = f.readlines()
-                assert len(lines) == 2  # Both sources
-            
-            # Verify sources
-            with open(output_path) as f:
-                sources = [json.loads(line)["source"] for line in f]
-                assert "stack" in sources
-                assert "bigquery" in sources
-            
-            mock_load_bigquery.assert_called_once()
+        output_path = tmp_path / "test.jsonl"
+        build_dataset(
+            str(output_path),
+            languages=["COBOL"],
+            include_bigquery=True
+        )
+        
+        # Verify file was created
+        assert output_path.exists()
+        
+        # Verify content
+        rows = _read_jsonl(output_path)
+        assert len(rows) == 2  # Both sources
+        
+        # Verify sources
+        assert {row["source"] for row in rows} == {"stack", "bigquery"}
+        
+        mock_load_bigquery.assert_called_once_with(num_workers=1)
     
     @patch("scripts.build_dataset.load_stack")
     @patch("scripts.build_dataset.load_bigquery")
-    def test_build_dataset_multiple_languages(self, mock_load_bigquery, mock_load_stack):
+    def test_build_dataset_multiple_languages(self, mock_load_bigquery, mock_load_stack, tmp_path):
         """Test building dataset with multiple languages."""
         # Mock data for each language
         def mock_stack_generator(lang):
@@ -129,50 +126,128 @@ class TestBuildDataset:
         
         mock_load_stack.side_effect = lambda lang: mock_stack_generator(lang)
         
-        with tempfile.TemporaryDirectory() as tmpdir:
-            output_path = Path(tmpdir) / "test.jsonl"
-            build_dataset(
-                str(output_path),
-                languages=["COBOL", "REXX", "RPGLE"],
-                include_bigquery=False
-            )
-            
-            # Verify file was created
-            assert output_path.exists()
-            
-            # Verify content
-            with open(output_path) as f:
-                lines = f.readlines()
-                assert len(lines) == 3  # One per language
-            
-            # Verify all languages are present
-            with open(output_path) as f:
-                languages = [json.loads(line)["language"] for line in f]
-                assert "COBOL" in languages
-                assert "REXX" in languages
-                assert "RPGLE" in languages
-            
-            assert mock_load_stack.call_count == 3
+        output_path = tmp_path / "test.jsonl"
+        build_dataset(
+            str(output_path),
+            languages=["COBOL", "REXX", "RPGLE"],
+            include_bigquery=False
+        )
+        
+        # Verify file was created
+        assert output_path.exists()
+        
+        # Verify content
+        rows = _read_jsonl(output_path)
+        assert len(rows) == 3  # One per language
+        
+        # Verify all languages are present (sources are written as they arrive)
+        assert {row["language"] for row in rows} == {"COBOL", "REXX", "RPGLE"}
+        
+        assert mock_load_stack.call_count == 3
     
     @patch("scripts.build_dataset.load_stack")
     @patch("scripts.build_dataset.load_bigquery")
-    def test_build_dataset_empty_results(self, mock_load_bigquery, mock_load_stack):
+    def test_build_dataset_empty_results(self, mock_load_bigquery, mock_load_stack, tmp_path):
         """Test building dataset with no results."""
         mock_load_stack.return_value = iter([])
         mock_load_bigquery.return_value = iter([])
         
-        with tempfile.TemporaryDirectory() as tmpdir:
-            output_path = Path(tmpdir) / "test.jsonl"
+        output_path = tmp_path / "test.jsonl"
+        build_dataset(
+            str(output_path),
+            languages=["COBOL"],
+            include_bigquery=False
+        )
+        
+        # File should still be created, just empty
+        assert output_path.exists()
+        
+        assert _read_jsonl(output_path) == []
+
+    
+    @patch("scripts.build_dataset.load_stack")
+    @patch("scripts.build_dataset.load_bigquery")
+    def test_build_dataset_non_ascii_content(self, mock_load_bigquery, mock_load_stack, tmp_path):
+        """Test that non-ASCII content is written as UTF-8 and round-trips."""
+        content = "IF A \xac= B THEN CALL X;\n"
+        mock_load_stack.return_value = iter([{"content": content, "source": "stack"}])
+        
+        output_path = tmp_path / "test.jsonl"
+        build_dataset(str(output_path), languages=["COBOL"], include_bigquery=False)
+        
+        row = _read_jsonl(output_path)[0]
+        assert row["content"] == content
+    
+    @patch("scripts.build_dataset.load_stack")
+    @patch("scripts.build_dataset.load_bigquery")
+    def test_build_dataset_spans_write_batches(self, mock_load_bigquery, mock_load_stack, tmp_path):
+        """Test that rows spanning several write batches are all written in order."""
+        # ~1 KiB rows, so the output spans a few WRITE_BATCH_BYTES batches
+        mock_load_stack.return_value = iter(
+            {"repo_name": f"repo{i}", "content": "x" * 1024} for i in range(2500)
+        )
+        
+        output_path = tmp_path / "test.jsonl"
+        build_dataset(str(output_path), languages=["COBOL"], include_bigquery=False)
+        
+        rows = _read_jsonl(output_path)
+        assert [row["repo_name"] for row in rows] == [f"repo{i}" for i in range(2500)]
+    
+    @patch("scripts.build_dataset.load_stack")
+    @patch("scripts.build_dataset.load_bigquery")
+    def test_build_dataset_writer_uses_orjson(self, mock_load_bigquery, mock_load_stack, tmp_path):
+        """Test that every row from every source is serialized once with orjson."""
+        mock_load_stack.side_effect = lambda lang: iter(
+            {"repo_name": f"repo{i}", "language": lang} for i in range(100)
+        )
+        mock_load_bigquery.return_value = iter({"repo_name": f"bq{i}"} for i in range(50))
+        
+        output_path = tmp_path / "test.jsonl"
+        with patch("scripts.build_dataset.orjson.dumps", wraps=orjson.dumps) as mock_dumps:
+            build_dataset(
+                str(output_path),
+                languages=["COBOL", "REXX"],
+                include_bigquery=True
+            )
+        
+        assert mock_dumps.call_count == 250
+        assert len(_read_jsonl(output_path)) == 250
+    
+    @patch("scripts.build_dataset.load_stack")
+    @patch("scripts.build_dataset.load_bigquery")
+    def test_build_dataset_source_error_propagates(self, mock_load_bigquery, mock_load_stack, tmp_path):
+        """Test that an error in one source stops the build and is raised."""
+        def mock_stack_generator(lang):
+            if lang == "REXX":
+                raise RuntimeError("download failed")
+            return iter({"repo_name": f"repo{i}"} for i in range(5000))
+        
+        mock_load_stack.side_effect = mock_stack_generator
+        
+        output_path = tmp_path / "test.jsonl"
+        with pytest.raises(RuntimeError, match="download failed"):
             build_dataset(
                 str(output_path),
-                languages=["COBOL"],
+                languages=["COBOL", "REXX"],
                 include_bigquery=False
             )
-            
-            # File should still be created, just empty
-            assert output_path.exists()
-            
-            with open(output_path) as f:
-                lines = f.readlines()
-                assert len(lines) == 0
-
+    
+    @patch("scripts.build_dataset.load_stack")
+    @patch("scripts.build_dataset.load_bigquery")
+    def test_build_dataset_write_is_batched(self, mock_load_bigquery, mock_load_stack):
+        """Test that output is written in WRITE_BATCH_BYTES chunks rather than per row."""
+        mock_load_stack.return_value = iter(
+            {"repo_name": f"repo{i}", "content": "x" * 1024} for i in range(5000)
+        )
+        
+        # Record sizes as written, since the writer reuses its buffer
+        write_sizes = []
+        mocked = mock_open()
+        mocked.return_value.write.side_effect = lambda data: write_sizes.append(len(data))
+        
+        with patch("scripts.build_dataset.open", mocked):
+            build_dataset("test.jsonl", languages=["COBOL"], include_bigquery=False)
+        
+        total_bytes = sum(write_sizes)
+        assert total_bytes > 5000 * 1024
+        assert len(write_sizes) <= math.ceil(total_bytes / WRITE_BATCH_BYTES) + 1
@@ -1,8 +1,17 @@
 """Tests for processing/filters.py"""
 
+from unittest.mock import patch
+
 import pytest
 
-from processing.filters import passes_filters, MAX_LINES, MAX_TOKENS, MIN_LINES
+from processing.filters import passes_filters, passes_filters_batch, MAX_CHARS, MAX_LINES, MAX_TOKENS, MIN_LINES
+
+_LONG_LINE = "word " * 10000  # Very long line
+
+
+def _nlines(n, line="line"):
+    """Build n newline-separated copies of line without an intermediate list."""
+    return (line + "\n") * (n - 1) + line
 
 
 class TestPassesFilters:
@@ -16,12 +25,12 @@ class TestPassesFilters:
     def test_too_few_lines(self):
         """Test that content with too few lines is filtered out."""
         # Create content with exactly MIN_LINES - 1 lines
-        content = "\n".join(["line"] * (MIN_LINES - 1))
+        content = _nlines(MIN_LINES - 1)
         assert passes_filters(content) is None
     
     def test_min_lines_passes(self):
         """Test that content with exactly MIN_LINES passes."""
-        content = "\n".join(["line"] * MIN_LINES)
+        content = _nlines(MIN_LINES)
         result = passes_filters(content)
         assert result is not None
         assert isinstance(result, int)
@@ -30,13 +39,13 @@ class TestPassesFilters:
     def test_too_many_lines(self):
         """Test that content with too many lines is filtered out."""
         # Create content with MAX_LINES + 1 lines
-        content = "\n".join(["line"] * (MAX_LINES + 1))
+        content = _nlines(MAX_LINES + 1)
         assert passes_filters(content) is None
     
     def test_max_lines_passes(self):
         """Test that content with exactly MAX_LINES passes (if token count is ok)."""
         # Use very short lines to keep token count low
-        content = "\n".join(["a"] * MAX_LINES)
+        content = _nlines(MAX_LINES, "a")
         result = passes_filters(content)
         # Should pass line check, but might fail token check
         # Just verify it returns None or int (not error)
@@ -45,8 +54,7 @@ class TestPassesFilters:
     def test_valid_content_returns_token_count(self):
         """Test that valid content returns a token count."""
         # Create content with reasonable line count
-        lines = ["This is a test line."] * 50
-        content = "\n".join(lines)
+        content = _nlines(50, "This is a test line.")
         result = passes_filters(content)
         
         assert result is not None
@@ -68,7 +76,7 @@ class TestPassesFilters:
        """.strip()
         
         # Repeat to get enough lines
-        content = "\n".join([cobol_code] * 2)
+        content = _nlines(2, cobol_code)
         result = passes_filters(content)
         
         # Should either pass or fail based on token count
@@ -93,11 +101,179 @@ Line 10"""
     
     def test_very_long_single_line(self):
         """Test content that might exceed token limit on a single line."""
-        # Create a very long single line that might exceed token count
-        long_line = "word " * 10000  # Very long line
-        content = "\n".join([long_line] * MIN_LINES)
+        # Repeat a very long line that might exceed token count
+        content = _nlines(MIN_LINES, _LONG_LINE)
         result = passes_filters(content)
         
         # Should be filtered out if token count exceeds MAX_TOKENS
         assert result is None or (isinstance(result, int) and result <= MAX_TOKENS)
+    
+    def test_trailing_newline_not_counted_as_line(self):
+        """Test that a trailing newline doesn't add a line, as with splitlines()."""
+        content = _nlines(MIN_LINES - 1) + "\n"
+        assert passes_filters(content) is None
+        assert passes_filters(content + "line") is not None
+    
+    def test_too_many_chars_skips_tokenizer(self, mock_tokenizer):
+        """Test that content longer than MAX_CHARS is rejected without tokenizing."""
+        # Few lines and few whitespace-separated tokens, but far too long
+        line = "x" * (MAX_CHARS // MIN_LINES + 1)
+        content = _nlines(MIN_LINES, line)
+        
+        assert passes_filters(content) is None
+        mock_tokenizer.backend_tokenizer.encode_batch_fast.assert_not_called()
+    
+    def test_passes_filters_no_list_allocation(self):
+        """Test that lines are counted without splitting the content into a list."""
+        class NoSplitlines(str):
+            def splitlines(self, *args, **kwargs):
+                raise AssertionError("splitlines should not be called")
+        
+        content = NoSplitlines(_nlines(MAX_LINES))
+        assert passes_filters(content) == MAX_LINES
 
+
+class TestPassesFiltersBatch:
+    """Test the passes_filters_batch function."""
+    
+    def test_matches_scalar_filter(self):
+        """Test that batched results match passes_filters for each content."""
+        contents = [
+            "",
+            _nlines(MIN_LINES - 1),
+            _nlines(50, "This is a test line."),
+            _nlines(MAX_LINES + 1),
+            _nlines(MIN_LINES),
+        ]
+        
+        assert passes_filters_batch(contents) == [passes_filters(c) for c in contents]
+    
+    @pytest.mark.parametrize("as_bytes", [False, True])
+    def test_matches_scalar_filter_matrix(self, as_bytes):
+        """Test batch/scalar equivalence across the length, line and token boundaries."""
+        contents = [
+            _nlines(num_lines, line) + trailer
+            for num_lines in (1, MIN_LINES - 1, MIN_LINES, MIN_LINES + 1, MAX_LINES, MAX_LINES + 1)
+            for line in ("", "x", "two words", "word " * 20)
+            for trailer in ("", "\n")
+        ]
+        # Too many tokens but few enough characters, and too many characters
+        contents.append(_nlines(MIN_LINES, "a " * (MAX_TOKENS // MIN_LINES + 1)))
+        contents.append("x" * (MAX_CHARS + 1))
+        if as_bytes:
+            contents = [c.encode("latin-1") for c in contents]
+        
+        batch = passes_filters_batch(contents)
+        
+        assert batch == [passes_filters(c) for c in contents]
+        assert any(result is not None for result in batch)
+        assert any(result is None for result in batch)
+    
+    def test_empty_batch(self):
+        """Test that an empty batch returns an empty list."""
+        assert passes_filters_batch([]) == []
+    
+    def test_backend_truncation_disabled(self, mock_tokenizer):
+        """Test that truncation configured on the backend tokenizer is turned off."""
+        mock_tokenizer.backend_tokenizer.truncation = {"max_length": 8}
+        
+        passes_filters_batch([_nlines(MIN_LINES)])
+        
+        mock_tokenizer.backend_tokenizer.no_truncation.assert_called_once()
+    
+    def test_only_line_filter_survivors_are_tokenized(self, mock_tokenizer):
+        """Test that files failing the line filter never reach the tokenizer."""
+        contents = ["short", _nlines(MIN_LINES)]
+        
+        result = passes_filters_batch(contents)
+        
+        assert result[0] is None
+        assert result[1] == MIN_LINES
+        encode_batch = mock_tokenizer.backend_tokenizer.encode_batch_fast
+        encode_batch.assert_called_once()
+        assert encode_batch.call_args[0][0] == [contents[1]]
+    
+    def test_duplicate_contents_tokenized_once(self, mock_tokenizer):
+        """Test that repeated contents are served from the token count cache."""
+        content = _nlines(50, "This is a test line.")
+        encode_batch = mock_tokenizer.backend_tokenizer.encode_batch_fast
+        
+        first = passes_filters_batch([content, content])
+        second = passes_filters_batch([content])
+        
+        assert first == [250, 250]
+        assert second == [250]
+        encode_batch.assert_called_once()
+        assert encode_batch.call_args[0][0] == [content]
+    
+    def test_str_and_its_utf8_bytes_cached_separately(self, mock_tokenizer):
+        """Test that a str and its UTF-8 bytes, which tokenize as different text, don't share a count."""
+        content = _nlines(MIN_LINES, "caf\u00e9 \u00ac= x")
+        # Count characters, so the latin-1 decoding of multi-byte UTF-8 counts more tokens
+        mock_tokenizer.backend_tokenizer.encode_batch_fast.side_effect = (
+            lambda texts, **kwargs: [list(text) for text in texts]
+        )
+        
+        from_str = passes_filters_batch([content])
+        from_bytes = passes_filters_batch([content.encode()])
+        
+        assert from_str == [len(content)]
+        assert from_bytes == [len(content.encode())]
+    
+    def test_token_count_cache_is_bounded(self, mock_tokenizer):
+        """Test that the least recently used counts are evicted past the cache size."""
+        import processing.filters
+        
+        contents = [_nlines(MIN_LINES, f"line {i}") for i in range(3)]
+        with patch.object(processing.filters, "TOKEN_COUNT_CACHE_SIZE", 2):
+            passes_filters_batch(contents)
+        
+        assert len(processing.filters._TOKEN_COUNT_CACHE) == 2
+    
+    def test_cache_eviction_during_tokenization(self, mock_tokenizer):
+        """Test that hits evicted by a concurrent call while tokenizing still return their counts."""
+        import processing.filters
+        
+        cached, new, other = (_nlines(MIN_LINES, f"line {i}") for i in range(3))
+        encode_batch = mock_tokenizer.backend_tokenizer.encode_batch_fast
+        tokenize = encode_batch.side_effect
+        
+        def tokenize_and_evict(texts, **kwargs):
+            # Stand in for another source thread filling the cache mid-call
+            if new in texts:
+                passes_filters_batch([other])
+            return tokenize(texts, **kwargs)
+        
+        with patch.object(processing.filters, "TOKEN_COUNT_CACHE_SIZE", 1):
+            passes_filters_batch([cached])
+            encode_batch.side_effect = tokenize_and_evict
+            
+            assert passes_filters_batch([cached, new]) == [20, 20]
+    
+    def test_cheap_filter_mask_matches_line_rules(self, mock_tokenizer):
+        """Test that the vectorized pre-filter applies the length and line bounds per content."""
+        from processing.filters import _cheap_filter_mask
+        
+        contents = [
+            "",
+            "a\n" * (MIN_LINES - 1),
+            "a\n" * MIN_LINES,
+            "a\n" * (MIN_LINES - 1) + "a",
+            "a\n" * (MAX_LINES + 1),
+            "a" * (MAX_CHARS + 1),
+        ]
+        
+        assert _cheap_filter_mask(contents).tolist() == [False, False, True, True, False, False]
+    
+    def test_bytes_match_str(self, mock_tokenizer):
+        """Test that raw latin-1 bytes are filtered and counted like the decoded text."""
+        contents = [
+            _nlines(MIN_LINES - 1),
+            _nlines(50, "IF A \xac= B THEN CALL X;"),
+            _nlines(MAX_LINES + 1),
+            _nlines(MIN_LINES) + "\n",
+        ]
+        
+        expected = passes_filters_batch(contents)
+        assert passes_filters_batch([c.encode("latin-1") for c in contents]) == expected
+        assert expected[1] is not None
@@ -0,0 +1,52 @@
+"""Tests for processing/licenses.py"""
+
+import pytest
+
+from processing.licenses import (
+    PERMISSIVE_LICENSE_NAMES,
+    PERMISSIVE_LICENSE_SPDX_IDS,
+    _PERMISSIVE_SPDX_IDS_LOWER,
+    classify_license_type,
+)
+
+
+class TestClassifyLicenseType:
+    """Test the classify_license_type function."""
+    
+    def test_missing_license(self):
+        """Test that a missing license is classified as no_license."""
+        assert classify_license_type(None) == "no_license"
+        assert classify_license_type("") == "no_license"
+    
+    @pytest.mark.parametrize("license_name", ["MIT", "Apache-2.0", "BSD-3-Clause", "CC0-1.0"])
+    def test_exact_spdx_id(self, license_name):
+        """Test that exact SPDX IDs are permissive."""
+        assert classify_license_type(license_name) == "permissive"
+    
+    @pytest.mark.parametrize("license_name", ["mit", "  Apache 2.0 ", "ZLIB", "bsd-2-clause-patent"])
+    def test_case_insensitive_and_common_names(self, license_name):
+        """Test that lowercase, padded and common-name variants are permissive."""
+        assert classify_license_type(license_name) == "permissive"
+    
+    @pytest.mark.parametrize("license_name", ["MIT-like", "apache-style", "bsd-original"])
+    def test_common_patterns(self, license_name):
+        """Test that MIT/Apache substrings and BSD prefixes are permissive."""
+        assert classify_license_type(license_name) == "permissive"
+    
+    @pytest.mark.parametrize("license_name", ["GPL-3.0", "AGPL-3.0", "LGPL-2.1", "proprietary-isc"])
+    def test_non_permissive(self, license_name):
+        """Test that copyleft and unrecognized licenses are no_license."""
+        assert classify_license_type(license_name) == "no_license"
+    
+    @pytest.mark.parametrize("license_name", ["gpl-with-bsd-exception", "commercial"])
+    def test_bsd_pattern_only_matches_prefix(self, license_name):
+        """Test that BSD is only treated as permissive at the start of a name."""
+        assert classify_license_type(license_name) == "no_license"
+    
+    @pytest.mark.parametrize(
+        "license_set",
+        [PERMISSIVE_LICENSE_SPDX_IDS, PERMISSIVE_LICENSE_NAMES, _PERMISSIVE_SPDX_IDS_LOWER],
+    )
+    def test_license_sets_are_frozensets(self, license_set):
+        """Test that license lookups stay hashed and immutable."""
+        assert isinstance(license_set, frozenset)
@@ -49,38 +49,17 @@ class TestLoadStack:
     
     @patch("ingestion.stack.load_dataset")
     @patch("ingestion.stack.download_blob")
-    @patch("ingestion.stack.passes_filters")
-    def test_load_stack_success(self, mock_passes_filters, mock_download, mock_load_dataset):
+    @patch("ingestion.stack.passes_filters_batch")
+    def test_load_stack_success(self, mock_passes_filters, mock_download, mock_load_dataset, mock_hf_token, stack_dataset_mock):
         """Test successful stack loading."""
-        # Mock dataset
-        mock_dataset = MagicMock()
-        
-        # Create mapped row (after dataset.map() transformation)
-        mock_row = {
-            "content": "\n".join(["line"] * 20),  # Content from download_blob
-            "licenses": ["MIT"],
-            "license_type": "MIT",
-            "host_url": "https://github.com",
-            "repo_name": "test/repo",
-            "file_path": "test/file.cob",
-            "language": "COBOL",
-            "extension": ".cob",
-            "branch": "main",
-            "revision_id": "abc123",
-            "commit_date": datetime(2024, 1, 1).isoformat(),
-        }
-        
-        # Mock the map() to return an iterable dataset
-        mapped_dataset = MagicMock()
-        mapped_dataset.__iter__ = lambda self: iter([mock_row])
-        mock_dataset.map.return_value = mapped_dataset
-        mock_load_dataset.return_value = mock_dataset
+        # Raw dataset row (content is downloaded separately)
+        mock_load_dataset.return_value = stack_dataset_mock()
         
         # Mock blob download
         mock_download.return_value = "\n".join(["line"] * 20)
         
         # Mock filter passing
-        mock_passes_filters.return_value = 100  # Token count
+        mock_passes_filters.side_effect = lambda contents: [100] * len(contents)  # Token count
         
         results = list(load_stack("COBOL"))
         
@@ -90,29 +69,25 @@ class TestLoadStack:
         assert result["file_path"] == "test/file.cob"
         assert result["language"] == "COBOL"
         assert result["license_type"] == "MIT"
+        assert result["licenses"] == ["MIT"]
         assert result["source"] == "stack"
         assert result["num_tokens"] == 100
         assert result["host_url"] == "https://github.com"
-        assert "revision_id" in result
-        assert "commit_date" in result
+        assert result["revision_id"] == "abc123"
+        assert result["commit_date"] == "2024-01-01T00:00:00"
+        assert result["branch"] == "main"
+        mock_download.assert_called_once_with("test-blob-id", "utf-8")
+        assert mock_load_dataset.call_args.kwargs["streaming"] is True
     
     @patch("ingestion.stack.load_dataset")
     @patch("ingestion.stack.download_blob")
-    @patch("ingestion.stack.passes_filters")
-    def test_load_stack_filters_out_none_content(self, mock_passes_filters, mock_download, mock_load_dataset):
+    @patch("ingestion.stack.passes_filters_batch")
+    def test_load_stack_filters_out_none_content(self, mock_passes_filters, mock_download, mock_load_dataset, mock_hf_token, stack_dataset_mock):
         """Test that None content is filtered out."""
-        mock_dataset = MagicMock()
-        # Row with None content (as returned by map())
-        mock_row = {
-            "content": None,
-            "repo_name": "test/repo",
-            "file_path": "test/file.cob",
-        }
-        
-        mapped_dataset = MagicMock()
-        mapped_dataset.__iter__ = lambda self: iter([mock_row])
-        mock_dataset.map.return_value = mapped_dataset
-        mock_load_dataset.return_value = mock_dataset
+        mock_load_dataset.return_value = stack_dataset_mock()
+        
+        # Download failure yields None content
+        mock_download.return_value = None
         
         results = list(load_stack("COBOL"))
         
@@ -122,33 +97,16 @@ class TestLoadStack:
     
     @patch("ingestion.stack.load_dataset")
     @patch("ingestion.stack.download_blob")
-    @patch("ingestion.stack.passes_filters")
-    def test_load_stack_filters_out_invalid_content(self, mock_passes_filters, mock_download, mock_load_dataset):
+    @patch("ingestion.stack.passes_filters_batch")
+    def test_load_stack_filters_out_invalid_content(self, mock_passes_filters, mock_download, mock_load_dataset, mock_hf_token, stack_dataset_mock):
         """Test that content failing filters is excluded."""
-        mock_dataset = MagicMock()
-        mock_row = MagicMock()
-        mock_row.__getitem__.side_effect = lambda key: {
-            "blob_id": "test-blob-id",
-            "src_encoding": "utf-8",
-            "detected_licenses": ["MIT"],
-            "license_type": "MIT",
-            "repo_name": "test/repo",
-            "path": "test/file.cob",
-            "language": "COBOL",
-            "extension": ".cob",
-            "branch_name": "main",
-            "revision_id": "abc123",
-            "committer_date": datetime(2024, 1, 1),
-        }.get(key)
-        
-        mock_dataset.map.return_value = [mock_row]
-        mock_load_dataset.return_value = mock_dataset
+        mock_load_dataset.return_value = stack_dataset_mock()
         
         # Mock blob download returning content
         mock_download.return_value = "some content"
         
         # Mock filter failing
-        mock_passes_filters.return_value = None
+        mock_passes_filters.side_effect = lambda contents: [None] * len(contents)
         
         results = list(load_stack("COBOL"))
         
@@ -157,30 +115,12 @@ class TestLoadStack:
     
     @patch("ingestion.stack.load_dataset")
     @patch("ingestion.stack.download_blob")
-    @patch("ingestion.stack.passes_filters")
-    def test_load_stack_schema(self, mock_passes_filters, mock_download, mock_load_dataset):
+    @patch("ingestion.stack.passes_filters_batch")
+    def test_load_stack_schema(self, mock_passes_filters, mock_download, mock_load_dataset, mock_hf_token, stack_dataset_mock):
         """Test that load_stack yields rows with correct schema."""
-        mock_dataset = MagicMock()
-        mock_row = {
-            "content": "\n".join(["line"] * 20),
-            "licenses": ["MIT"],
-            "license_type": "MIT",
-            "host_url": "https://github.com",
-            "repo_name": "test/repo",
-            "file_path": "test/file.cob",
-            "language": "COBOL",
-            "extension": ".cob",
-            "branch": "main",
-            "revision_id": "abc123",
-            "commit_date": datetime(2024, 1, 1).isoformat(),
-        }
-        
-        mapped_dataset = MagicMock()
-        mapped_dataset.__iter__ = lambda self: iter([mock_row])
-        mock_dataset.map.return_value = mapped_dataset
-        mock_load_dataset.return_value = mock_dataset
+        mock_load_dataset.return_value = stack_dataset_mock()
         mock_download.return_value = "\n".join(["line"] * 20)
-        mock_passes_filters.return_value = 100
+        mock_passes_filters.side_effect = lambda contents: [100] * len(contents)
         
         results = list(load_stack("COBOL"))
         
@@ -198,4 +138,62 @@ class TestLoadStack:
         
         assert result["source"] == "stack"
         assert result["host_url"] == "https://github.com"
-
+    
+    @patch("ingestion.stack.load_dataset")
+    @patch("ingestion.stack.download_blob")
+    @patch("ingestion.stack.passes_filters_batch")
+    def test_load_stack_skips_download_for_invalid_extension(self, mock_passes_filters, mock_download, mock_load_dataset, mock_hf_token, stack_dataset_mock):
+        """Test that rows with invalid extensions are never downloaded."""
+        mock_load_dataset.return_value = stack_dataset_mock(path="test/file.txt", extension=".txt")
+        
+        results = list(load_stack("COBOL"))
+        
+        assert len(results) == 0
+        mock_download.assert_not_called()
+        mock_passes_filters.assert_not_called()
+    
+    @patch("ingestion.stack.load_dataset")
+    @patch("ingestion.stack.download_blob")
+    @patch("ingestion.stack.passes_filters_batch")
+    def test_load_stack_preserves_order_with_prefetch(self, mock_passes_filters, mock_download, mock_load_dataset, mock_hf_token):
+        """Test that prefetched downloads are yielded in dataset order."""
+        rows = [
+            {
+                "blob_id": f"blob-{i}",
+                "src_encoding": "utf-8",
+                "detected_licenses": [],
+                "license_type": "no_license",
+                "repo_name": f"test/repo{i}",
+                "path": "test/file.cob",
+                "language": "COBOL",
+                "extension": ".cob",
+                "branch_name": "main",
+                "revision_id": "abc123",
+                "committer_date": datetime(2024, 1, 1),
+            }
+            for i in range(300)
+        ]
+        
+        mock_load_dataset.return_value = rows
+        mock_download.side_effect = lambda blob_id, encoding: f"content of {blob_id}"
+        mock_passes_filters.side_effect = lambda contents: [100] * len(contents)
+        
+        results = list(load_stack("COBOL"))
+        
+        assert [r["repo_name"] for r in results] == [f"test/repo{i}" for i in range(300)]
+        assert results[-1]["content"] == "content of blob-299"
+    
+    @patch("ingestion.stack.load_dataset")
+    @patch("ingestion.stack.download_blob")
+    @patch("ingestion.stack.passes_filters_batch")
+    def test_load_stack_reuses_dataset(self, mock_passes_filters, mock_download, mock_load_dataset, mock_hf_token, stack_dataset_mock):
+        """Test that the dataset is resolved once per language and re-iterated."""
+        mock_load_dataset.return_value = stack_dataset_mock()
+        mock_download.return_value = "\n".join(["line"] * 20)
+        mock_passes_filters.side_effect = lambda contents: [100] * len(contents)
+        
+        first = list(load_stack("COBOL"))
+        second = list(load_stack("COBOL"))
+        
+        assert len(first) == len(second) == 1
+        mock_load_dataset.assert_called_once()
@@ -2,13 +2,68 @@
 
 import json
 import os
-import tempfile
 from pathlib import Path
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
+import orjson
+import pyarrow as pa
+import pyarrow.parquet as pq
 import pytest
+from datasets import Dataset
+from huggingface_hub import DatasetCard
+from huggingface_hub.utils import RepositoryNotFoundError
 
-from upload import upload_to_hf
+from upload import (
+    DATASET_CARD,
+    DEFAULT_CONFIG,
+    MIN_SHARD_SIZE_BYTES,
+    SHARD_SIZE_BYTES,
+    _align_to_schema,
+    _drop_duplicates,
+    _jsonl_to_parquet,
+    _num_shards,
+    _read_shard_schema,
+    _update_dataset_card,
+    _write_shards,
+    upload_to_hf,
+)
+
+
+class _FakeDataset:
+    """Stand-in for a Dataset of nbytes whose shards write empty parquet files."""
+    
+    def __init__(self, nbytes):
+        self.data = SimpleNamespace(nbytes=nbytes)
+        self.written = []
+        self.batch_sizes = []
+    
+    def __len__(self):
+        # One row per byte, so there are always enough rows for every shard
+        return self.data.nbytes
+    
+    def shard(self, num_shards, index, contiguous):
+        return SimpleNamespace(to_parquet=self._to_parquet)
+    
+    def _to_parquet(self, path, batch_size=None):
+        Path(path).touch()
+        self.written.append(path)
+        self.batch_sizes.append(batch_size)
+
+
+# Built once: raising it from repo_info simulates a dataset repo that doesn't exist yet
+_NOT_FOUND = RepositoryNotFoundError("Not found", response=MagicMock(status_code=404))
+
+
+def _write_jsonl(path, records):
+    """Write records to path as JSONL in a single write and return the path as a string."""
+    path.write_bytes(b"".join(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE) for record in records))
+    return str(path)
+
+
+def _siblings(*paths):
+    """Return repo_info siblings for the given repo paths."""
+    return [SimpleNamespace(rfilename=path) for path in paths]
 
 
 class TestUploadToHF:
@@ -19,139 +74,426 @@ class TestUploadToHF:
         with pytest.raises(FileNotFoundError):
             upload_to_hf(["nonexistent.jsonl"], "test-dataset")
     
-    def test_invalid_file_extension(self):
+    def test_invalid_file_extension(self, tmp_path):
         """Test that ValueError is raised for non-JSONL files."""
-        with tempfile.NamedTemporaryFile(suffix=".txt", delete=False) as f:
-            f.write(b"test")
-            temp_path = f.name
+        path = tmp_path / "data.txt"
+        path.write_text("test")
         
-        try:
-            with pytest.raises(ValueError, match="must be a JSONL file"):
-                upload_to_hf([temp_path], "test-dataset")
-        finally:
-            os.unlink(temp_path)
+        with pytest.raises(ValueError, match="must be a JSONL file"):
+            upload_to_hf([str(path)], "test-dataset")
     
     @patch.dict(os.environ, {}, clear=True)
-    def test_missing_hf_token(self):
-        """Test that ValueError is raised when HF_TOKEN is missing."""
-        with tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False) as f:
-            f.write(b'{"test": "data"}\n')
-            temp_path = f.name
-        
-        try:
-            with pytest.raises(ValueError, match="No Hugging Face token"):
-                upload_to_hf([temp_path], "test-dataset")
-        finally:
-            os.unlink(temp_path)
-    
-    @patch("upload.create_repo")
-    @patch("upload.load_dataset")
-    @patch("upload.concatenate_datasets")
-    def test_upload_new_dataset(
-        self, mock_concat, mock_load_dataset, mock_create_repo
-    ):
-        """Test uploading to a new dataset."""
-        with tempfile.NamedTemporaryFile(suffix=".jsonl", mode="w", delete=False) as f:
-            json.dump({"test": "data1"}, f)
-            f.write("\n")
-            json.dump({"test": "data2"}, f)
-            f.write("\n")
-            temp_path = f.name
-        
-        try:
-            with patch.dict(os.environ, {"HF_TOKEN": "test-token"}):
-                # Mock dataset object
-                mock_dataset = MagicMock()
-                mock_dataset.push_to_hub = MagicMock()
-                
-                # Mock load_dataset to raise for existing dataset check, but succeed for json load
-                def load_side_effect(*args, **kwargs):
-                    repo_id = args[0] if args else kwargs.get("repo_id", "")
-                    if "zorse/test-dataset" in str(repo_id):
-                        # Check for existing dataset - raise to simulate not found
-                        from huggingface_hub.utils import HfHubHTTPError
-                        raise HfHubHTTPError("Not found", response=MagicMock(status_code=404))
-                    # For json file load, return dataset
-                    return mock_dataset
-                
-                mock_load_dataset.side_effect = load_side_effect
-                
-                upload_to_hf([temp_path], "test-dataset")
-                
-                mock_create_repo.assert_called_once()
-                mock_dataset.push_to_hub.assert_called_once()
-        finally:
-            os.unlink(temp_path)
-    
-    @patch("upload.create_repo")
-    @patch("upload.load_dataset")
-    @patch("upload.concatenate_datasets")
-    def test_upload_merge_existing(
-        self, mock_concat, mock_load_dataset, mock_create_repo
-    ):
-        """Test uploading and merging with existing dataset."""
-        with tempfile.NamedTemporaryFile(suffix=".jsonl", mode="w", delete=False) as f:
-            json.dump({"test": "new_data"}, f)
-            f.write("\n")
-            temp_path = f.name
-        
-        try:
-            with patch.dict(os.environ, {"HF_TOKEN": "test-token"}):
-                # Mock existing dataset
-                mock_existing = MagicMock()
-                mock_new = MagicMock()
-                mock_combined = MagicMock()
-                mock_combined.push_to_hub = MagicMock()
-                
-                def load_side_effect(*args, **kwargs):
-                    repo_id = args[0] if args else kwargs.get("repo_id", "")
-                    if "zorse/test-dataset" in str(repo_id):
-                        return mock_existing
-                    return mock_new
-                
-                mock_load_dataset.side_effect = load_side_effect
-                mock_concat.return_value = mock_combined
-                
-                upload_to_hf([temp_path], "test-dataset")
-                
-                mock_concat.assert_called_once()
-                mock_combined.push_to_hub.assert_called_once()
-        finally:
-            os.unlink(temp_path)
-    
-    @patch("upload.create_repo")
-    @patch("upload.load_dataset")
-    def test_upload_multiple_files(self, mock_load_dataset, mock_create_repo):
-        """Test uploading multiple JSONL files."""
-        files = []
-        try:
-            for i in range(2):
-                f = tempfile.NamedTemporaryFile(suffix=".jsonl", mode="w", delete=False)
-                json.dump({"file": i, "data": f"test{i}"}, f)
-                f.write("\n")
-                f.close()
-                files.append(f.name)
-            
-            with patch.dict(os.environ, {"HF_TOKEN": "test-token"}):
-                mock_dataset = MagicMock()
-                mock_dataset.push_to_hub = MagicMock()
-                
-                def load_side_effect(*args, **kwargs):
-                    repo_id = args[0] if args else ""
-                    if "zorse/test-dataset" in str(repo_id):
-                        from huggingface_hub.utils import HfHubHTTPError
-                        raise HfHubHTTPError("Not found", response=MagicMock(status_code=404))
-                    return mock_dataset
-                
-                mock_load_dataset.side_effect = load_side_effect
-                
-                upload_to_hf(files, "test-dataset")
-                
-                # Should create repo once
-                mock_create_repo.assert_called_once()
-                # Should push once with all files
-                mock_dataset.push_to_hub.assert_called_once()
-        finally:
-            for f in files:
-                os.unlink(f)
+    @patch("dotenv.load_dotenv")
+    def test_missing_hf_token(self, mock_load_dotenv, tmp_path):
+        """Test that ValueError is raised when HF_TOKEN is missing, after checking .env."""
+        path = _write_jsonl(tmp_path / "data.jsonl", [{"test": "data"}])
+        
+        with pytest.raises(ValueError, match="No Hugging Face token"):
+            upload_to_hf([path], "test-dataset")
+        mock_load_dotenv.assert_called_once()
+    
+    @patch("dotenv.load_dotenv")
+    def test_hf_token_in_env_skips_dotenv(self, mock_load_dotenv, mock_hf_upload, tmp_path):
+        """Test that .env is not read when HF_TOKEN is already set."""
+        path = _write_jsonl(tmp_path / "data.jsonl", [{"test": "data"}])
+        mock_hf_upload.load_dataset.return_value = _FakeDataset(1024)
+        
+        upload_to_hf([path], "test-dataset")
+        
+        mock_load_dotenv.assert_not_called()
+    
+    @pytest.mark.parametrize(
+        "siblings, num_files, expected_paths",
+        [
+            pytest.param(
+                None, 1, ["data/train-00000-of-00001.parquet"], id="new_dataset"
+            ),
+            pytest.param(
+                None, 2, ["data/train-00000-of-00001.parquet"], id="multiple_files"
+            ),
+            pytest.param(
+                (".gitattributes",),
+                1,
+                ["data/train-00000-of-00001.parquet"],
+                id="empty_repo",
+            ),
+            pytest.param(
+                (
+                    "README.md",
+                    "data/train-00000-of-00002.parquet",
+                    "data/train-00001-of-00002.parquet",
+                ),
+                1,
+                ["data/train-00002-of-00003.parquet"],
+                id="appends_to_existing",
+            ),
+        ],
+    )
+    def test_upload(self, mock_hf_upload, tmp_path, siblings, num_files, expected_paths):
+        """Test that new data is committed once, as shards numbered after the existing ones."""
+        files = [
+            _write_jsonl(tmp_path / f"data{i}.jsonl", [{"file": i, "data": f"test{i}"}])
+            for i in range(num_files)
+        ]
+        dataset = _FakeDataset(1024)
+        mock_hf_upload.load_dataset.return_value = dataset
+        if siblings is None:
+            mock_hf_upload.api.repo_info.side_effect = _NOT_FOUND
+            sha = None
+        else:
+            sha = "abc123"
+            mock_hf_upload.api.repo_info.return_value = SimpleNamespace(
+                sha=sha, siblings=_siblings(*siblings)
+            )
+        
+        upload_to_hf(files, "test-dataset")
+        
+        # Every Hub call goes through one authenticated client
+        mock_hf_upload.hf_api.assert_called_once_with(token="test-hf-token")
+        assert mock_hf_upload.api.create_repo.called == (siblings is None)
+        # Only the JSONL files are loaded; the existing dataset is never downloaded
+        mock_hf_upload.load_dataset.assert_called_once_with("json", data_files=files, split="train")
+        assert len(dataset.written) == 1
+        mock_hf_upload.api.preupload_lfs_files.assert_called_once()
+        
+        mock_hf_upload.api.create_commit.assert_called_once()
+        commit_kwargs = mock_hf_upload.api.create_commit.call_args.kwargs
+        *shard_ops, card_op = commit_kwargs["operations"]
+        assert [op.path_in_repo for op in shard_ops] == expected_paths
+        assert card_op.path_in_repo == "README.md"
+        if siblings is None or "README.md" not in siblings:
+            assert card_op.path_or_fileobj == DATASET_CARD.encode()
+        else:
+            # An existing card keeps its text and metadata but loses the stale dataset_info
+            mock_hf_upload.api.hf_hub_download.assert_called_once_with(
+                repo_id="zorse/test-dataset", filename="README.md", repo_type="dataset", revision=sha
+            )
+            card = card_op.path_or_fileobj.decode()
+            assert "Existing description." in card
+            assert "license: mit" in card
+            assert "dataset_info" not in card
+            assert "path: data/train-*" in card
+        assert commit_kwargs["parent_commit"] == sha
+        
+        # Appended data is cast to the schema of an existing shard, read at the parent commit
+        if expected_paths[0].startswith("data/train-00000-"):
+            mock_hf_upload.read_shard_schema.assert_not_called()
+        else:
+            mock_hf_upload.read_shard_schema.assert_called_once_with(
+                "zorse/test-dataset", "data/train-00000-of-00002.parquet", sha, "test-hf-token"
+            )
+            mock_hf_upload.align_to_schema.assert_called_once_with(
+                dataset, mock_hf_upload.read_shard_schema.return_value
+            )
+    
+    @patch("upload.SHARD_SIZE_BYTES", 1024)
+    def test_upload_shards_in_parallel(self, mock_hf_upload, tmp_path):
+        """Test that shards are written and uploaded with num_proc workers."""
+        path = _write_jsonl(tmp_path / "data.jsonl", [{"test": "new_data"}])
+        dataset = _FakeDataset(3 * 1024)
+        mock_hf_upload.load_dataset.return_value = dataset
+        mock_hf_upload.api.repo_info.return_value.siblings = _siblings("README.md")
+        
+        upload_to_hf([path], "test-dataset", num_proc=2)
+        
+        # One shard per SHARD_SIZE_BYTES
+        assert len(dataset.written) == 3
+        
+        preupload_kwargs = mock_hf_upload.api.preupload_lfs_files.call_args.kwargs
+        assert preupload_kwargs["repo_id"] == "zorse/test-dataset"
+        assert preupload_kwargs["repo_type"] == "dataset"
+        assert preupload_kwargs["num_threads"] == 2
+        
+        operations = mock_hf_upload.api.create_commit.call_args.kwargs["operations"]
+        assert preupload_kwargs["additions"] == operations
+        assert [op.path_in_repo for op in operations] == [
+            *(f"data/train-{i:05d}-of-00003.parquet" for i in range(3)),
+            "README.md",
+        ]
+    
+    def test_upload_shard_and_batch_size(self, mock_hf_upload, tmp_path):
+        """Test that shard_size and batch_size override the sharding defaults."""
+        path = _write_jsonl(tmp_path / "data.jsonl", [{"test": "data"}])
+        dataset = _FakeDataset(4 * 1024)
+        mock_hf_upload.load_dataset.return_value = dataset
+        mock_hf_upload.api.repo_info.return_value.siblings = _siblings("README.md")
+        
+        upload_to_hf([path], "test-dataset", num_proc=1, shard_size=1024, batch_size=10)
+        
+        assert len(dataset.written) == 4
+        assert dataset.batch_sizes == [10] * 4
+    
+    @patch("upload.JSONL_FAST_PATH_BYTES", 0)
+    def test_upload_large_input_loads_parquet(self, mock_hf_upload, tmp_path):
+        """Test that inputs above the fast-path size are converted to parquet before loading."""
+        path = _write_jsonl(tmp_path / "data.jsonl", [{"test": "data"}])
+        mock_hf_upload.load_dataset.return_value = _FakeDataset(1024)
+        
+        upload_to_hf([path], "test-dataset")
+        
+        args, kwargs = mock_hf_upload.load_dataset.call_args
+        assert args == ("parquet",)
+        assert len(kwargs["data_files"]) == 1
+        assert kwargs["data_files"][0].endswith(".parquet")
+    
+    @patch("upload._drop_duplicates")
+    def test_upload_dedup_key(self, mock_drop_duplicates, mock_hf_upload, tmp_path):
+        """Test that the deduplicated dataset is what gets sharded."""
+        path = _write_jsonl(tmp_path / "data.jsonl", [{"id": 1}])
+        loaded = _FakeDataset(1024)
+        deduped = _FakeDataset(1024)
+        mock_hf_upload.load_dataset.return_value = loaded
+        mock_drop_duplicates.return_value = deduped
+        
+        upload_to_hf([path], "test-dataset", dedup_key="id")
+        
+        mock_drop_duplicates.assert_called_once_with(loaded, "id")
+        assert len(deduped.written) == 1
+        assert loaded.written == []
+
+
+class TestUpdateDatasetCard:
+    """Test the _update_dataset_card function."""
+    
+    def test_replaces_default_config_only(self, tmp_path):
+        """Test that the default config is repointed while other configs and the body are kept."""
+        card_path = tmp_path / "README.md"
+        card_path.write_text(
+            "---\n"
+            "configs:\n"
+            "- config_name: default\n"
+            "  data_files: old/*.parquet\n"
+            "- config_name: extra\n"
+            "  data_files: extra/*.parquet\n"
+            "---\n"
+            "\n"
+            "Body.\n"
+        )
+        
+        card = DatasetCard(_update_dataset_card(str(card_path)))
+        
+        assert card.data["configs"] == [
+            DEFAULT_CONFIG,
+            {"config_name": "extra", "data_files": "extra/*.parquet"},
+        ]
+        assert card.text.strip() == "Body."
+
+
+class TestReadShardSchema:
+    """Test the _read_shard_schema function."""
+    
+    @pytest.mark.parametrize(
+        "revision, expected_path",
+        [
+            ("abc123", "datasets/zorse/test@abc123/data/train-00000-of-00001.parquet"),
+            (None, "datasets/zorse/test/data/train-00000-of-00001.parquet"),
+        ],
+        ids=["at_revision", "main"],
+    )
+    @patch("upload.HfFileSystem")
+    def test_reads_footer(self, mock_fs, tmp_path, revision, expected_path):
+        """Test that the schema is read from the shard through the Hub filesystem."""
+        schema = pa.schema([("id", pa.int64()), ("licenses", pa.list_(pa.string()))])
+        shard = tmp_path / "shard.parquet"
+        pq.write_table(schema.empty_table(), shard)
+        mock_fs.return_value.open.side_effect = lambda path, mode: open(shard, mode)
+        
+        result = _read_shard_schema("zorse/test", "data/train-00000-of-00001.parquet", revision, "token")
+        
+        assert result.equals(schema)
+        mock_fs.assert_called_once_with(token="token")
+        mock_fs.return_value.open.assert_called_once_with(expected_path, "rb")
+
+
+class TestAlignToSchema:
+    """Test the _align_to_schema function."""
+    
+    EXISTING = pa.schema([("id", pa.int64()), ("licenses", pa.list_(pa.string())), ("text", pa.string())])
+    
+    def test_matching_schema_returns_dataset(self):
+        """Test that data already in the existing schema is returned unchanged."""
+        dataset = Dataset(pa.table({"id": [1], "licenses": [["MIT"]], "text": ["a"]}, schema=self.EXISTING))
+        
+        assert _align_to_schema(dataset, self.EXISTING) is dataset
+    
+    def test_promotes_null_and_fills_missing_columns(self):
+        """Test that all-[] lists take the existing type and missing columns become nulls."""
+        dataset = Dataset.from_dict({"licenses": [[], []], "id": [1, 2]})
+        assert dataset.data.schema.field("licenses").type == pa.list_(pa.null())
+        
+        aligned = _align_to_schema(dataset, self.EXISTING)
+        
+        assert aligned.data.schema.equals(self.EXISTING)
+        assert aligned.to_dict() == {"id": [1, 2], "licenses": [[], []], "text": [None, None]}
+    
+    @pytest.mark.parametrize(
+        "columns",
+        [
+            {"id": [1], "licenses": [["MIT"]], "text": ["a"], "stars": [5]},
+            {"id": [1.5], "licenses": [["MIT"]], "text": ["a"]},
+            {"id": [1], "licenses": [["MIT"]], "text": [[1]]},
+        ],
+        ids=["extra_column", "widened_type", "incompatible_type"],
+    )
+    def test_unalignable_schema(self, columns):
+        """Test that data the existing shards can't hold raises ValueError."""
+        with pytest.raises(ValueError, match="can't be aligned with the existing shards"):
+            _align_to_schema(Dataset.from_dict(columns), self.EXISTING)
+
+
+class TestNumShards:
+    """Test the _num_shards function."""
+    
+    @pytest.mark.parametrize(
+        "nbytes, num_proc, expected",
+        [
+            (0, 4, 1),
+            (MIN_SHARD_SIZE_BYTES - 1, 4, 1),
+            (3 * MIN_SHARD_SIZE_BYTES, 4, 3),
+            (3 * MIN_SHARD_SIZE_BYTES, 2, 2),
+            (SHARD_SIZE_BYTES + 1, 1, 2),
+            (10 * SHARD_SIZE_BYTES, 4, 10),
+        ],
+        ids=["empty", "below_min", "one_per_worker", "capped_by_workers", "rounds_up", "capped_by_size"],
+    )
+    def test_num_shards(self, nbytes, num_proc, expected):
+        """Test that shards stay under the target size and spread across workers."""
+        assert _num_shards(nbytes, num_proc, SHARD_SIZE_BYTES) == expected
+
+
+class TestWriteShards:
+    """Test the _write_shards function."""
+    
+    def test_no_more_shards_than_rows(self, tmp_path):
+        """Test that a dataset larger than shard_size but with few rows gets one shard per row."""
+        dataset = Dataset.from_dict({"text": ["x" * 100, "y" * 100]})
+        
+        shard_paths = _write_shards(dataset, str(tmp_path), num_proc=1, shard_size=10)
+        
+        assert shard_paths == [f"data/train-{i:05d}-of-00002.parquet" for i in range(2)]
+        assert [pq.read_table(tmp_path / path).num_rows for path in shard_paths] == [1, 1]
 
+
+class TestJsonlToParquet:
+    """Test the _jsonl_to_parquet function."""
+    
+    @staticmethod
+    def read_rows(parquet_paths):
+        """Read the rows of parquet files that must all share one schema."""
+        schemas = [pq.read_schema(path) for path in parquet_paths]
+        assert all(schema.equals(schemas[0]) for schema in schemas)
+        return [row for path in parquet_paths for row in pq.read_table(path).to_pylist()]
+    
+    @patch("upload.READ_CHUNK_BYTES", 16)
+    def test_round_trip(self, tmp_path):
+        """Test that records split across read chunks and batches survive conversion."""
+        rows = [{"text": f"row {i} " * i, "id": i} for i in range(10)]
+        jsonl_path = tmp_path / "rows.jsonl"
+        jsonl_path.write_text("".join(json.dumps(row) + "\n" for row in rows) + "\n")
+        
+        parquet_paths = _jsonl_to_parquet([str(jsonl_path)], str(tmp_path), batch_size=3)
+        
+        assert self.read_rows(parquet_paths) == rows
+    
+    @patch("upload.JSONL_BATCH_BYTES", 250)
+    def test_batches_bounded_by_bytes(self, tmp_path):
+        """Test that large rows are cut into batches by input size before the row limit."""
+        rows = [{"id": i, "text": "x" * 100} for i in range(5)]
+        path = _write_jsonl(tmp_path / "rows.jsonl", rows)
+        
+        parquet_paths = _jsonl_to_parquet([path], str(tmp_path), batch_size=100)
+        
+        # Each line is ~120 bytes, so a batch closes on its third row
+        assert [pq.read_metadata(path).num_rows for path in parquet_paths] == [3, 2]
+        assert self.read_rows(parquet_paths) == rows
+    
+    @pytest.mark.parametrize("num_proc", [1, 3])
+    def test_inputs_keep_order(self, tmp_path, num_proc):
+        """Test that rows come back in input order and empty inputs are skipped."""
+        paths = []
+        for name, content in [("a", '{"id": 1}\n'), ("empty", ""), ("b", '{"id": 2}')]:
+            path = tmp_path / f"{name}.jsonl"
+            path.write_text(content)
+            paths.append(str(path))
+        
+        parquet_paths = _jsonl_to_parquet(paths, str(tmp_path), num_proc=num_proc)
+        
+        assert self.read_rows(parquet_paths) == [{"id": 1}, {"id": 2}]
+    
+    def test_late_appearing_key(self, tmp_path):
+        """Test that a key first seen after the first row or batch is kept for every row."""
+        rows = [{"id": 0}, {"id": 1}, {"id": 2, "extra": "x"}, {"id": 3, "extra": "y"}]
+        path = _write_jsonl(tmp_path / "rows.jsonl", rows)
+        
+        parquet_paths = _jsonl_to_parquet([path], str(tmp_path), batch_size=2)
+        
+        assert self.read_rows(parquet_paths) == [
+            {"id": 0, "extra": None},
+            {"id": 1, "extra": None},
+            {"id": 2, "extra": "x"},
+            {"id": 3, "extra": "y"},
+        ]
+    
+    def test_null_first_columns(self, tmp_path):
+        """Test that columns that are null or [] in the first batch take later batches' types."""
+        rows = [
+            {"license": None, "licenses": []},
+            {"license": "MIT", "licenses": ["MIT"]},
+        ]
+        path = _write_jsonl(tmp_path / "rows.jsonl", rows)
+        
+        parquet_paths = _jsonl_to_parquet([path], str(tmp_path), batch_size=1)
+        
+        assert self.read_rows(parquet_paths) == rows
+        assert pq.read_schema(parquet_paths[0]).field("licenses").type == pa.list_(pa.string())
+    
+    def test_schemas_unified_across_files(self, tmp_path):
+        """Test that files whose inferred schemas differ are written with one schema."""
+        paths = [
+            _write_jsonl(tmp_path / "a.jsonl", [{"id": 1, "license": None}]),
+            _write_jsonl(tmp_path / "b.jsonl", [{"id": 2, "license": "MIT", "stars": 5}]),
+        ]
+        
+        parquet_paths = _jsonl_to_parquet(paths, str(tmp_path), num_proc=2)
+        
+        assert self.read_rows(parquet_paths) == [
+            {"id": 1, "license": None, "stars": None},
+            {"id": 2, "license": "MIT", "stars": 5},
+        ]
+
+
+class TestDropDuplicates:
+    """Test the _drop_duplicates function."""
+    
+    def test_keeps_first_row_per_key(self):
+        """Test that later duplicates are dropped and row order is preserved."""
+        dataset = Dataset.from_dict({"id": [1, 2, 1, 3, 2], "text": ["a", "b", "c", "d", "e"]})
+        
+        deduped = _drop_duplicates(dataset, "id")
+        
+        assert deduped.to_dict() == {"id": [1, 2, 3], "text": ["a", "b", "d"]}
+    
+    def test_no_duplicates_returns_dataset(self):
+        """Test that a dataset without duplicates is returned unchanged."""
+        dataset = Dataset.from_dict({"id": [1, 2, 3]})
+        
+        assert _drop_duplicates(dataset, "id") is dataset
+    
+    def test_missing_key(self):
+        """Test that ValueError is raised for a key that isn't a column."""
+        dataset = Dataset.from_dict({"id": [1, 2, 3]})
+        
+        with pytest.raises(ValueError, match="not a column"):
+            _drop_duplicates(dataset, "sha")
+    
+    def test_deduped_dataset_shards_by_kept_rows(self, tmp_path):
+        """Test that shards of a deduplicated dataset are sized and cut from the kept rows."""
+        dataset = Dataset.from_dict({"id": [0] + [i % 2 for i in range(1, 20)], "text": ["x" * 100] * 20})
+        
+        deduped = _drop_duplicates(dataset, "id")
+        shard_paths = _write_shards(deduped, str(tmp_path), num_proc=2, shard_size=1000)
+        
+        assert deduped.data.num_rows == 2
+        assert len(shard_paths) == 1
+        rows = pq.read_table(tmp_path / shard_paths[0]).to_pylist()
+        assert rows == [{"id": 0, "text": "x" * 100}, {"id": 1, "text": "x" * 100}]
@@ -1,59 +1,491 @@
 import argparse
 import os
-from typing import List
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
 
-from datasets import concatenate_datasets, load_dataset
-from dotenv import load_dotenv
-from huggingface_hub import create_repo
-from huggingface_hub.utils import HfHubHTTPError
+import numpy as np
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from datasets import Dataset, Features, load_dataset
+from huggingface_hub import CommitOperationAdd, DatasetCard, HfApi, HfFileSystem
+from huggingface_hub.utils import RepositoryNotFoundError
 from loguru import logger
 
-load_dotenv()
+SHARD_SIZE_BYTES = 400 * 1024 * 1024  # target Arrow bytes per parquet shard
+MIN_SHARD_SIZE_BYTES = 64 * 1024 * 1024  # smallest shard worth splitting off for another worker
+JSONL_FAST_PATH_BYTES = 500 * 1024 * 1024  # inputs above this are converted with orjson
+READ_CHUNK_BYTES = 1 << 20
+JSONL_BATCH_SIZE = 100_000
+# Input bytes per Arrow batch; each conversion worker holds one batch, so its
+# parsed rows and their Arrow copy stay around 100-200 MB however large the rows
+JSONL_BATCH_BYTES = 32 * 1024 * 1024
 
+# Points the default config at the uploaded shards
+DEFAULT_CONFIG = {"config_name": "default", "data_files": [{"split": "train", "path": "data/train-*"}]}
+DATASET_CARD = """---
+configs:
+- config_name: default
+  data_files:
+  - split: train
+    path: data/train-*
+---
+"""
 
-def upload_to_hf(file_paths: List[str], dataset_name):
+
+def _default_num_proc() -> int:
+    """Return one fewer than the number of CPUs, but at least one."""
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def _iter_jsonl_lines(path: str) -> Iterator[bytes]:
+    """
+    Read the lines of a JSONL file in large chunks.
+    
+    Args:
+        path: Path to the JSONL file.
+        
+    Yields:
+        bytes: Each non-empty line, without its newline.
+    """
+    with open(path, "rb", buffering=READ_CHUNK_BYTES) as f:
+        tail = b""
+        while chunk := f.read(READ_CHUNK_BYTES):
+            lines = (tail + chunk).split(b"\n")
+            # The last piece may be a partial line, so carry it into the next chunk
+            tail = lines.pop()
+            for line in lines:
+                if line.strip():
+                    yield line
+        if tail.strip():
+            yield tail
+
+
+def _iter_jsonl_batches(path: str, batch_size: int) -> Iterator[List[dict]]:
+    """
+    Parse a JSONL file with orjson in batches bounded by rows and bytes.
+    
+    Args:
+        path: Path to the JSONL file.
+        batch_size: Maximum number of records per batch.
+        
+    Yields:
+        List[dict]: Parsed records, cut after batch_size records or once they
+            span JSONL_BATCH_BYTES of input, whichever comes first.
+    """
+    rows = []
+    nbytes = 0
+    for line in _iter_jsonl_lines(path):
+        rows.append(orjson.loads(line))
+        nbytes += len(line)
+        # Rows can be up to ~1 MB each, so a row count alone doesn't bound the
+        # memory each conversion worker holds
+        if len(rows) >= batch_size or nbytes >= JSONL_BATCH_BYTES:
+            yield rows
+            rows = []
+            nbytes = 0
+    if rows:
+        yield rows
+
+
+def _convert_jsonl_file(path: str, out_prefix: str, batch_size: int) -> List[Tuple[str, pa.Schema]]:
+    """
+    Convert one JSONL file to parquet, writing one parquet file per batch.
+    
+    Args:
+        path: Path to the JSONL file.
+        out_prefix: Path prefix of the parquet files, suffixed with the batch index.
+        batch_size: Maximum number of records converted to Arrow at a time.
+        
+    Returns:
+        List[Tuple[str, pa.Schema]]: Path and inferred schema of each written
+            parquet file, in order (empty for empty inputs).
+    """
+    pieces = []
+    for batch_index, rows in enumerate(_iter_jsonl_batches(path, batch_size)):
+        # pa.array infers the struct type from every row, so keys that only
+        # appear after the first row are kept
+        table = pa.Table.from_struct_array(pa.array(rows))
+        parquet_path = f"{out_prefix}-{batch_index:05d}.parquet"
+        pq.write_table(table, parquet_path)
+        pieces.append((parquet_path, table.schema))
+    return pieces
+
+
+def _conform_parquet(path: str, schema: pa.Schema) -> None:
+    """
+    Rewrite a parquet file in place to match schema.
+    
+    Args:
+        path: Path to the parquet file.
+        schema: Schema to cast to; columns the file lacks are filled with nulls.
+    """
+    table = pq.read_table(path)
+    columns = [
+        table.column(field.name).cast(field.type)
+        if field.name in table.column_names
+        else pa.nulls(table.num_rows, field.type)
+        for field in schema
+    ]
+    pq.write_table(pa.Table.from_arrays(columns, schema=schema), path)
+
+
+def _jsonl_to_parquet(
+    paths: List[str],
+    out_dir: str,
+    batch_size: int = JSONL_BATCH_SIZE,
+    num_proc: Optional[int] = None,
+) -> List[str]:
+    """
+    Convert JSONL files to parquet files that all share one schema.
+    
+    Args:
+        paths: Paths to the JSONL files.
+        out_dir: Directory the parquet files are written to.
+        batch_size: Maximum number of records converted to Arrow at a time.
+        num_proc (Optional[int]): Number of files converted concurrently
+            (defaults to one fewer than the number of CPUs).
+        
+    Returns:
+        List[str]: Paths of the written parquet files, in input order.
+    """
+    out_prefixes = [os.path.join(out_dir, f"{index:05d}") for index in range(len(paths))]
+    
+    # Files are independent, and Arrow conversion and parquet encoding release the GIL
+    if num_proc is None:
+        num_proc = _default_num_proc()
+    with ThreadPoolExecutor(max_workers=max(1, min(len(paths), num_proc))) as executor:
+        pieces = [
+            piece
+            for file_pieces in executor.map(
+                _convert_jsonl_file, paths, out_prefixes, [batch_size] * len(paths)
+            )
+            for piece in file_pieces
+        ]
+        if not pieces:
+            return []
+        
+        # Each batch infers its own types, so a column that is null or [] in one
+        # batch is promoted to the type another batch found, and columns missing
+        # from a batch are added; only batches that differ are rewritten
+        schema = pa.unify_schemas([piece_schema for _, piece_schema in pieces], promote_options="permissive")
+        stale_paths = [path for path, piece_schema in pieces if not piece_schema.equals(schema)]
+        list(executor.map(_conform_parquet, stale_paths, [schema] * len(stale_paths)))
+    
+    return [path for path, _ in pieces]
+
+
+def _num_shards(nbytes: int, num_proc: int, shard_size: int) -> int:
+    """
+    Pick how many shards to split nbytes of Arrow data into.
+    
+    Args:
+        nbytes: Arrow size of the dataset.
+        num_proc: Number of workers writing and uploading shards.
+        shard_size: Target Arrow size of each shard.
+        
+    Returns:
+        int: Enough shards to keep each under shard_size, raised to one per
+            worker as long as every shard keeps at least MIN_SHARD_SIZE_BYTES.
+    """
+    return max(1, -(-nbytes // shard_size), min(num_proc, nbytes // MIN_SHARD_SIZE_BYTES))
+
+
+def _drop_duplicates(dataset: Dataset, key: str) -> Dataset:
+    """
+    Keep only the first row for each value of a column.
+    
+    Args:
+        dataset: The dataset to deduplicate.
+        key: Name of the column identifying duplicate rows.
+        
+    Returns:
+        Dataset: The dataset without later duplicates, in the original order.
+    """
+    if key not in dataset.column_names:
+        raise ValueError(f"Dedup key '{key}' is not a column of the dataset.")
+    
+    # index_in returns the first position of each unique value, so the whole
+    # pass runs in Arrow's hash kernels instead of a Python set
+    column = dataset.data.table.column(key)
+    first_indices = np.sort(pc.index_in(pc.unique(column), value_set=column).to_numpy())
+    if len(first_indices) == len(dataset):
+        return dataset
+    
+    logger.info(f"Dropping {len(dataset) - len(first_indices)} rows with duplicate '{key}' values")
+    # select only adds an indices mapping over the full table; flattening it keeps
+    # dataset.data (and the shard sizes derived from it) down to the kept rows
+    return dataset.select(first_indices).flatten_indices()
+
+
+def _update_dataset_card(card_path: str) -> str:
+    """
+    Point an existing dataset card at the shards, keeping the rest of it.
+    
+    Args:
+        card_path: Local path of the repo's README.md.
+        
+    Returns:
+        str: The card with the default config set and dataset_info removed.
+    """
+    card = DatasetCard.load(card_path)
+    # A card pushed by push_to_hub records dataset_info split sizes for the old
+    # data, which fail verification once shards are appended
+    card.data.pop("dataset_info", None)
+    other_configs = [
+        config for config in card.data.get("configs") or [] if config.get("config_name") != "default"
+    ]
+    card.data["configs"] = [DEFAULT_CONFIG, *other_configs]
+    return str(card)
+
+
+def _read_shard_schema(repo_id: str, shard_path: str, revision: Optional[str], token: str) -> pa.Schema:
+    """
+    Read the schema of a parquet shard in a dataset repo.
+    
+    Args:
+        repo_id: ID of the dataset repo.
+        shard_path: Path of the shard in the repo.
+        revision (Optional[str]): Commit to read the shard at (defaults to the main branch).
+        token: Hugging Face token.
+        
+    Returns:
+        pa.Schema: The shard's schema, read from its footer without downloading the data.
+    """
+    repo_path = f"datasets/{repo_id}@{revision}" if revision else f"datasets/{repo_id}"
+    with HfFileSystem(token=token).open(f"{repo_path}/{shard_path}", "rb") as f:
+        return pq.read_schema(f)
+
+
+def _align_to_schema(dataset: Dataset, schema: pa.Schema) -> Dataset:
+    """
+    Cast a dataset to the schema of the shards it is appended to.
+    
+    Args:
+        dataset: The new data.
+        schema: Schema of the existing shards.
+        
+    Returns:
+        Dataset: The dataset with the existing columns, order and types; columns
+            it lacks are filled with nulls, and null-typed columns (such as
+            lists that are always []) take the existing type.
+    """
+    if dataset.data.schema.equals(schema):
+        return dataset
+    
+    # Promoting the new types into the existing ones must not widen anything,
+    # otherwise the old and new shards can't be loaded together
+    try:
+        unified = pa.unify_schemas([schema, dataset.data.schema], promote_options="permissive")
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        raise ValueError(f"New data can't be aligned with the existing shards: {e}") from e
+    mismatched = [
+        field.name
+        for field in unified
+        if field.name not in schema.names or field.type != schema.field(field.name).type
+    ]
+    if mismatched:
+        raise ValueError(
+            f"New data can't be aligned with the existing shards; columns {mismatched} "
+            f"are missing from or have a different type in the existing schema."
+        )
+    
+    for name in schema.names:
+        if name not in dataset.column_names:
+            dataset = dataset.add_column(name, [None] * len(dataset))
+    try:
+        return dataset.cast(Features.from_arrow_schema(schema))
+    except (ValueError, TypeError, pa.ArrowInvalid) as e:
+        raise ValueError(f"New data can't be aligned with the existing shards: {e}") from e
+
+
+def _write_shards(
+    dataset: Dataset,
+    folder_path: str,
+    num_proc: Optional[int] = None,
+    start_index: int = 0,
+    shard_size: Optional[int] = None,
+    batch_size: Optional[int] = None,
+) -> List[str]:
+    """
+    Write a dataset as parquet shards under folder_path/data.
+    
+    Args:
+        dataset: The dataset to write.
+        folder_path: Local folder that mirrors the dataset repo layout.
+        num_proc (Optional[int]): Number of shards written concurrently
+            (defaults to one fewer than the number of CPUs).
+        start_index (int): Index of the first shard, so appended shards
+            don't collide with the ones already in the repo.
+        shard_size (Optional[int]): Target Arrow size of each shard
+            (defaults to SHARD_SIZE_BYTES).
+        batch_size (Optional[int]): Rows written to parquet at a time
+            (defaults to the datasets library's default).
+        
+    Returns:
+        List[str]: Repo paths of the written shards.
+    """
+    if num_proc is None:
+        num_proc = _default_num_proc()
+    
+    if shard_size is None:
+        shard_size = SHARD_SIZE_BYTES
+    
+    # contiguous sharding needs at least one row per shard
+    num_shards = min(_num_shards(dataset.data.nbytes, num_proc, shard_size), max(1, len(dataset)))
+    total_shards = start_index + num_shards
+    shard_paths = [
+        f"data/train-{i:05d}-of-{total_shards:05d}.parquet"
+        for i in range(start_index, total_shards)
+    ]
+    os.makedirs(os.path.join(folder_path, "data"), exist_ok=True)
+    
+    def write_shard(index: int) -> None:
+        shard = dataset.shard(num_shards=num_shards, index=index, contiguous=True)
+        shard.to_parquet(os.path.join(folder_path, shard_paths[index]), batch_size=batch_size)
+    
+    # Parquet encoding and compression release the GIL, so shards are written in parallel
+    with ThreadPoolExecutor(max_workers=num_proc) as executor:
+        list(executor.map(write_shard, range(num_shards)))
+    
+    return shard_paths
+
+
+def upload_to_hf(
+    file_paths: List[str],
+    dataset_name,
+    num_proc: Optional[int] = None,
+    dedup_key: Optional[str] = None,
+    shard_size: Optional[int] = None,
+    batch_size: Optional[int] = None,
+):
     """
     Uploads one or more JSONL files to Hugging Face Datasets. If the dataset repo
-    already exists, it appends the new data to the existing dataset and re-pushes it.
-    Otherwise, it creates a new dataset.
+    already exists, the new data is committed as extra shards next to the existing
+    ones. Otherwise, it creates a new dataset.
     
     Args:
         file_paths (List[str]): Paths to the JSONL files to upload.
         dataset_name (str): Name of the dataset on Hugging Face.
+        num_proc (Optional[int]): Number of shards written and uploaded concurrently
+            (defaults to one fewer than the number of CPUs).
+        dedup_key (Optional[str]): Column whose duplicate values are dropped from the
+            new data before uploading, keeping the first row for each value.
+        shard_size (Optional[int]): Target Arrow size of each parquet shard in bytes
+            (defaults to SHARD_SIZE_BYTES).
+        batch_size (Optional[int]): Rows per Arrow batch when converting large JSONL
+            inputs and writing shards (defaults to JSONL_BATCH_SIZE for conversion and
+            the datasets library's default for writing).
     """
     
+    # One stat per file both checks existence and gives the input size
+    total_bytes = 0
     for file_path in file_paths:
-        if not os.path.exists(file_path):
-            raise FileNotFoundError(f"The file '{file_path}' does not exist.")
+        try:
+            total_bytes += os.stat(file_path).st_size
+        except FileNotFoundError:
+            raise FileNotFoundError(f"The file '{file_path}' does not exist.") from None
         
         if not file_path.endswith(".jsonl"):
             raise ValueError("The file must be a JSONL file with a '.jsonl' extension.")
     
+    # Only look for a .env file when the token isn't already in the environment
+    if not os.environ.get("HF_TOKEN"):
+        from dotenv import load_dotenv
+        load_dotenv()
+    
     token = os.getenv("HF_TOKEN")   
     if not token:
         raise ValueError("No Hugging Face token provided. Set the HF_TOKEN environment variable or pass it explicitly.")
     
     repo_id = f"zorse/{dataset_name}"
-    create_repo(repo_id=repo_id, token=token, repo_type="dataset", private=True, exist_ok=True)
+    api = HfApi(token=token)
     
+    # Probe the repo's metadata rather than downloading the whole dataset
+    # just to find out whether there is one
     try:
-        existing_dataset = load_dataset(repo_id, split="train", use_auth_token=token)
-        logger.info("Existing dataset found. It will be merged with the new data.")
-    except HfHubHTTPError:
+        repo_info = api.repo_info(repo_id=repo_id, repo_type="dataset")
+        repo_files = [sibling.rfilename for sibling in repo_info.siblings or []]
+        parent_commit = repo_info.sha
+    except RepositoryNotFoundError:
+        api.create_repo(repo_id=repo_id, repo_type="dataset", private=True, exist_ok=True)
+        repo_files = []
+        parent_commit = None
+    
+    # Existing shards are left in place and the new rows are appended as
+    # further shards, so each run only uploads the new data
+    existing_shards = [path for path in repo_files if path.startswith("data/") and path.endswith(".parquet")]
+    if existing_shards:
+        logger.info(f"Existing dataset found with {len(existing_shards)} shards. New shards will be appended.")
+    else:
         logger.info("No existing dataset found. A new dataset will be created.")
-        existing_dataset = None
 
-    dataset = load_dataset("json", data_files=file_paths, split="train")
+    if num_proc is None:
+        num_proc = _default_num_proc()
     
-    if existing_dataset is not None:
-        combined_dataset = concatenate_datasets([existing_dataset, dataset])
+    # Arrow's JSON reader is CPU-bound on large inputs, so parse those with
+    # orjson and let load_dataset read the much cheaper parquet instead
+    if total_bytes > JSONL_FAST_PATH_BYTES:
+        with tempfile.TemporaryDirectory() as parquet_dir:
+            parquet_paths = _jsonl_to_parquet(
+                file_paths, parquet_dir, batch_size=batch_size or JSONL_BATCH_SIZE, num_proc=num_proc
+            )
+            dataset = load_dataset("parquet", data_files=parquet_paths, split="train")
     else:
-        combined_dataset = dataset
-
-    combined_dataset.push_to_hub(
-        repo_id=repo_id,
-        token=token
-    )
+        dataset = load_dataset("json", data_files=file_paths, split="train")
+    
+    if dedup_key is not None:
+        dataset = _drop_duplicates(dataset, dedup_key)
+    
+    # Shards that disagree on types (e.g. list<null> next to list<string>) can't
+    # be loaded together, so the new data must fit the schema already in the repo
+    if existing_shards:
+        existing_schema = _read_shard_schema(repo_id, existing_shards[0], parent_commit, token)
+        dataset = _align_to_schema(dataset, existing_schema)
+    
+    os.environ.setdefault("HF_XET_HIGH_PERFORMANCE", "1")
+    with tempfile.TemporaryDirectory() as folder_path:
+        shard_paths = _write_shards(
+            dataset,
+            folder_path,
+            num_proc=num_proc,
+            start_index=len(existing_shards),
+            shard_size=shard_size,
+            batch_size=batch_size,
+        )
+        operations = [
+            CommitOperationAdd(path_in_repo=path, path_or_fileobj=os.path.join(folder_path, path))
+            for path in shard_paths
+        ]
+        # Keep the description and metadata of an existing card; only repos
+        # without one get the bare card
+        if "README.md" in repo_files:
+            card_path = api.hf_hub_download(
+                repo_id=repo_id, filename="README.md", repo_type="dataset", revision=parent_commit
+            )
+            card = _update_dataset_card(card_path)
+        else:
+            card = DATASET_CARD
+        operations.append(CommitOperationAdd(path_in_repo="README.md", path_or_fileobj=card.encode()))
+        
+        # Upload the shard blobs concurrently, then add them all in one commit
+        api.preupload_lfs_files(
+            repo_id=repo_id,
+            additions=operations,
+            repo_type="dataset",
+            num_threads=num_proc,
+        )
+        api.create_commit(
+            repo_id=repo_id,
+            repo_type="dataset",
+            operations=operations,
+            commit_message=f"Add {len(shard_paths)} shards",
+            # Commit on top of the revision the shard numbering came from, so a
+            # concurrent append fails instead of overwriting its shards
+            parent_commit=parent_commit,
+        )
     
     logger.info(f"Dataset '{dataset_name}' successfully uploaded/updated to Hugging Face Datasets at: https://huggingface.co/datasets/{repo_id}")
 
@@ -62,10 +494,38 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Upload a JSONL file to Hugging Face Datasets.")
     parser.add_argument("--name", type=str, required=True, help="Name of the dataset on Hugging Face.")
     parser.add_argument("--paths", nargs="+", required=True, help="Paths to the JSONL files.")
+    parser.add_argument(
+        "--num-proc",
+        type=int,
+        default=None,
+        help="Number of shards written and uploaded concurrently.",
+    )
+    parser.add_argument(
+        "--dedup-key",
+        type=str,
+        default=None,
+        help="Column used to drop duplicate rows from the new data before uploading.",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=None,
+        help="Target Arrow size of each parquet shard in MiB (default: 400).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help="Rows per Arrow batch when converting large JSONL inputs and writing shards.",
+    )
     
     args = parser.parse_args()
     
     upload_to_hf(
         file_paths=args.paths,
         dataset_name=args.name,
+        num_proc=args.num_proc,
+        dedup_key=args.dedup_key,
+        shard_size=args.shard_size * 1024 * 1024 if args.shard_size else None,
+        batch_size=args.batch_size,
     ) 
\ No newline at end of file